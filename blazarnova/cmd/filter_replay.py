@@ -0,0 +1,238 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Replay recorded scheduling requests through BlazarFilter.
+
+The hosts and aggregates of a cloud are loaded from a snapshot, the pool
+index of the filter is warmed up with the aggregates as nova-scheduler
+does when it starts, then the recorded requests are run through the
+filter, without any nova database or message bus. The throughput, the
+latency distribution and the outcome of each request are reported as
+JSON.
+
+The snapshot is a JSON, or msgpack, object::
+
+    {"hosts": ["host1", "host2"],
+     "aggregates": [{"id": 1, "name": "freepool", "hosts": ["host1"],
+                     "metadata": {}}]}
+
+The requests are a list of objects, or one object per line::
+
+    {"id": "req-1", "project_id": "...",
+     "scheduler_hints": {"reservation": ["..."]},
+     "flavor_extra_specs": {"blazar:preemptible": "true"}}
+
+The options of the filter are read from the nova configuration files
+given with --config-file.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+
+from blazarnova.scheduler.filters import blazar_filter
+
+from nova import objects
+from oslo_config import cfg
+from oslo_utils import importutils
+
+msgpack = importutils.try_import('msgpack')
+
+
+class ReplayHostState(object):
+    """The part of a nova HostState used by BlazarFilter."""
+
+    def __init__(self, host, aggregates):
+        self.host = host
+        self.nodename = host
+        self.aggregates = aggregates
+
+    def __repr__(self):
+        return '(%s, %s)' % (self.host, self.nodename)
+
+
+def _is_msgpack(path):
+    return path.endswith(('.msgpack', '.mpk'))
+
+
+def _load(path):
+    """Return the objects stored in a JSON or msgpack file."""
+    if _is_msgpack(path):
+        if msgpack is None:
+            raise SystemExit('msgpack is needed to read %s' % path)
+        with open(path, 'rb') as f:
+            return list(msgpack.Unpacker(f, raw=False))
+
+    with open(path) as f:
+        content = f.read()
+    try:
+        return [json.loads(content)]
+    except ValueError:
+        # One object per line
+        return [json.loads(line) for line in content.splitlines()
+                if line.strip()]
+
+
+def load_snapshot(path):
+    """Return the host states and the aggregates of a snapshot."""
+    snapshot = _load(path)[0]
+    aggregates = []
+    aggregates_by_host = {}
+    for values in snapshot.get('aggregates', []):
+        aggregate = objects.Aggregate(
+            id=values['id'], name=values['name'],
+            hosts=list(values.get('hosts', [])),
+            metadata=dict(values.get('metadata') or {}))
+        aggregates.append(aggregate)
+        for host in aggregate.hosts:
+            aggregates_by_host.setdefault(host, []).append(aggregate)
+
+    hosts = list(snapshot.get('hosts', []))
+    known = set(hosts)
+    hosts.extend(sorted(host for host in aggregates_by_host
+                        if host not in known))
+    host_states = [ReplayHostState(host, aggregates_by_host.get(host, []))
+                   for host in hosts]
+    return host_states, aggregates
+
+
+def load_requests(path):
+    """Return the recorded requests as (request ID, RequestSpec) tuples."""
+    items = _load(path)
+    if len(items) == 1 and isinstance(items[0], list):
+        items = items[0]
+    requests = []
+    for i, values in enumerate(items):
+        spec_obj = objects.RequestSpec(
+            project_id=values.get('project_id'),
+            scheduler_hints=dict(
+                (key, value if isinstance(value, list) else [value])
+                for key, value in (values.get('scheduler_hints') or
+                                   {}).items()),
+            flavor=objects.Flavor(
+                flavorid=values.get('flavor_id', 'replay'),
+                extra_specs=dict(values.get('flavor_extra_specs') or {})))
+        requests.append((values.get('id', i), spec_obj))
+    return requests
+
+
+def percentiles(samples):
+    """Return the usual percentiles of a list of durations, in ms."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    result = {}
+    for name, rank in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        index = min(len(samples) - 1, int(rank * len(samples)))
+        result[name] = samples[index] * 1000
+    result['max'] = samples[-1] * 1000
+    result['mean'] = sum(samples) / len(samples) * 1000
+    return result
+
+
+def replay(host_states, aggregates, requests, repeat=1, record_hosts=False):
+    """Run requests through BlazarFilter and return the report.
+
+    The pool index of the filter is first warmed up with the aggregates,
+    so that the requests are filtered as in a running nova-scheduler.
+    """
+    f = blazar_filter.BlazarFilter()
+    f.pool_index.warm_up(aggregates)
+    durations = []
+    outcomes = []
+    start = time.perf_counter()
+    for iteration in range(repeat):
+        for request_id, spec_obj in requests:
+            request_class = blazar_filter.classify_request(spec_obj)[0]
+            request_start = time.perf_counter()
+            passing = f.filter_all(host_states, spec_obj)
+            duration = time.perf_counter() - request_start
+            durations.append(duration)
+            if iteration:
+                continue
+
+            names = sorted(host_state.host for host_state in passing)
+            outcome = {
+                'id': request_id,
+                'request_class': request_class,
+                'passed': len(names),
+                # Compared between runs to find diverging decisions
+                'digest': hashlib.sha256(
+                    '\n'.join(names).encode('utf-8')).hexdigest(),
+                'duration_ms': duration * 1000,
+            }
+            if record_hosts:
+                outcome['hosts'] = names
+            outcomes.append(outcome)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'hosts': len(host_states),
+        'aggregates': len(aggregates),
+        'index_complete': f.pool_index.complete,
+        'warmup_ms': (f.pool_index.warmup_duration or 0) * 1000,
+        'requests': len(durations),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(durations) / elapsed if elapsed else 0,
+        'latency_ms': percentiles(durations),
+        'outcomes': outcomes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='blazar-nova-filter-replay',
+        description=__doc__.splitlines()[0])
+    parser.add_argument('snapshot',
+                        help='JSON or msgpack file of hosts and aggregates.')
+    parser.add_argument('requests',
+                        help='JSON or msgpack file of recorded requests.')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='nova configuration file with the '
+                             '[blazar:physical:host] options.')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of times the requests are replayed. '
+                             'Only the outcomes of the first time are '
+                             'reported.')
+    parser.add_argument('--record-hosts', action='store_true',
+                        help='Report the names of the passing hosts of '
+                             'each request.')
+    parser.add_argument('--output',
+                        help='File to write the report to, instead of '
+                             'stdout.')
+    args = parser.parse_args(argv)
+
+    objects.register_all()
+    cfg.CONF([], project='nova', default_config_files=args.config_file)
+
+    host_states, aggregates = load_snapshot(args.snapshot)
+    report = replay(host_states, aggregates, load_requests(args.requests),
+                    repeat=args.repeat, record_hosts=args.record_hosts)
+    sys.stderr.write('%d requests on %d hosts: %.1f requests/s, p50 %.2f ms, '
+                     'p99 %.2f ms\n'
+                     % (report['requests'], report['hosts'],
+                        report['throughput_rps'],
+                        report['latency_ms'].get('p50', 0),
+                        report['latency_ms'].get('p99', 0)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,97 +14,761 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import logging as std_logging
+import random
+import time
+import weakref
+
 from blazarnova.i18n import _
+from blazarnova.scheduler.filters import membership
+from blazarnova.scheduler.filters import metrics
+from blazarnova.scheduler.filters import pool_index
+from blazarnova.scheduler.filters import reservation_cache
+from blazarnova.scheduler.filters import result_cache
+from blazarnova.scheduler.filters import shared_index
+from blazarnova.scheduler.filters import tracing
 
 from nova.scheduler import filters
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils.strutils import bool_from_string
+from oslo_utils import timeutils
 
 LOG = logging.getLogger(__name__)
 
 FLAVOR_EXTRA_SPEC = "aggregate_instance_extra_specs:reservation"
 FLAVOR_PREEMPTIBLE = "blazar:preemptible"
 
+# Classes of scheduling requests, as seen by BlazarFilter
+RESERVATION = 'reservation'
+INSTANCE_RESERVATION = 'instance_reservation'
+PREEMPTIBLE = 'preemptible'
+PLAIN = 'plain'
+
+# Reasons for rejecting a reservation request as a whole, or a host
+REJECT_UNAUTHORIZED = 'unauthorized'
+REJECT_UNKNOWN_POOL = 'unknown_pool'
+REJECT_INACTIVE = 'inactive_reservation'
+REJECT_NOT_IN_POOL = 'not_in_requested_pool'
+REJECT_IN_POOL = 'in_blazar_pool'
+REJECT_NOT_PREEMPTIBLE = 'not_only_in_preemptible_aggregate'
+REJECT_TIME_BUDGET = 'time_budget_exceeded'
+
 opts = [
     cfg.StrOpt('aggregate_freepool_name',
                default='freepool',
+               mutable=True,
                help='Name of the special aggregate where all hosts '
                     'are candidate for physical host reservation'),
     cfg.BoolOpt('allow_preemptibles',
                 default=False,
+                mutable=True,
                 help='Whether to allow preemptible instances to be scheduled '
                      'on hosts in the preemptible aggregate'),
     cfg.StrOpt('preemptible_aggregate',
                default='freepool',
+               mutable=True,
                help='Name of the aggregate where hosts can run preemptible '
                     'instances'),
     cfg.StrOpt('project_id_key',
                default='blazar:tenant',
+               mutable=True,
                help='Aggregate metadata value for key matching project_id'),
     cfg.StrOpt('blazar_owner',
                default='blazar:owner',
+               mutable=True,
                help='Aggregate metadata key for knowing owner project_id'),
     cfg.StrOpt('blazar_az_prefix',
                default='blazar_',
-               help='Prefix for Availability Zones created by Blazar')
+               mutable=True,
+               help='Prefix for Availability Zones created by Blazar'),
+    cfg.BoolOpt('placement_reservation_prefilter',
+                default=False,
+                mutable=True,
+                help='Whether to restrict the placement query of requests '
+                     'with a reservation hint to the aggregates of the '
+                     'requested reservations. The Blazar pools must be '
+                     'mirrored as placement aggregates.'),
+    cfg.BoolOpt('placement_exclude_pools_prefilter',
+                default=False,
+                mutable=True,
+                help='Whether to exclude the Blazar pools, including the '
+                     'freepool, from the placement query of requests '
+                     'without reservation. The Blazar pools must be '
+                     'mirrored as placement aggregates.'),
+    cfg.BoolOpt('placement_preemptible_prefilter',
+                default=False,
+                mutable=True,
+                help='Whether to restrict the placement query of requests '
+                     'for preemptible instances to the preemptible '
+                     'aggregate, excluding the other Blazar pools. The '
+                     'Blazar pools must be mirrored as placement '
+                     'aggregates.'),
+    cfg.IntOpt('result_cache_size',
+               default=0,
+               min=0,
+               help='Number of distinct requests for which the filter '
+                    'decisions are cached and reused by identical requests. '
+                    '0 disables the cache.'),
+    cfg.IntOpt('result_cache_ttl',
+               default=10,
+               min=1,
+               help='Number of seconds the cached filter decisions of a '
+                    'request are reused for.'),
+    cfg.FloatOpt('decision_log_sample_rate',
+                 default=1.0,
+                 min=0.0,
+                 max=1.0,
+                 mutable=True,
+                 help='Fraction of the requests for which the reason each '
+                      'host is rejected is logged, at DEBUG level. A '
+                      'summary of the decisions is logged for every '
+                      'request.'),
+    cfg.FloatOpt('shadow_sample_rate',
+                 default=0.0,
+                 min=0.0,
+                 max=1.0,
+                 mutable=True,
+                 help='Fraction of the requests whose hosts are also checked '
+                      'with the reference implementation of the filter, '
+                      'which uses no index nor cache. Any difference in the '
+                      'decisions is logged, as well as the time taken by '
+                      'both. 0 disables the checks.'),
+    cfg.IntOpt('chunk_size',
+               default=1000,
+               min=0,
+               mutable=True,
+               help='Number of hosts checked at once, the filter lets other '
+                    'green threads run between two chunks. 0 checks all the '
+                    'hosts of a request at once.'),
+    cfg.FloatOpt('time_budget',
+                 default=0.0,
+                 min=0.0,
+                 mutable=True,
+                 help='Seconds the filter may spend on the hosts of a '
+                      'request, checked between two chunks of hosts. Once '
+                      'spent, the hosts left are rejected. 0 sets no '
+                      'limit.'),
+    cfg.IntOpt('reservation_cache_interval',
+               default=0,
+               min=0,
+               help='Seconds between two listings of the Blazar leases, '
+                    'from which the state of the reservations is cached so '
+                    'that requests for reservations which are not active '
+                    'are rejected without checking any host. The Blazar '
+                    'API is reached with the options of the [blazar] '
+                    'group. 0 disables the cache.'),
+    cfg.IntOpt('reservation_cache_max_age',
+               default=300,
+               min=1,
+               help='Age in seconds of the last listing of the Blazar '
+                    'leases past which the cached reservation states are '
+                    'not used anymore.'),
+    cfg.StrOpt('shared_index_path',
+               help='Path of a file, preferably on a memory backed file '
+                    'system, through which the nova-scheduler workers of '
+                    'a host share the Blazar pool index. One of them '
+                    'builds the index and publishes it there, the others '
+                    'map it instead of building their own.'),
+    cfg.BoolOpt('metrics_enabled',
+                default=False,
+                help='Whether to collect metrics of the filter decisions '
+                     'and durations.'),
+    cfg.StrOpt('metrics_textfile',
+               help='Path of the file the metrics are written to, in the '
+                    'Prometheus text exposition format, for the textfile '
+                    'collector of the node exporter. Each nova-scheduler '
+                    'worker writes its own file, with its pid inserted '
+                    'before the extension, and adds a pid label to its '
+                    'metrics. A worker removes its file when it exits, and '
+                    'the files of the workers which are gone when it first '
+                    'writes its own.'),
+    cfg.IntOpt('metrics_export_interval',
+               default=15,
+               min=1,
+               help='Minimum number of seconds between two exports of the '
+                    'metrics.'),
 ]
 
 cfg.CONF.register_opts(opts, 'blazar:physical:host')
 
+# Snapshot of the blazar:physical:host options, so that they are not looked
+# up in oslo.config for every request or host.
+Settings = collections.namedtuple('Settings', [opt.dest for opt in opts])
+
+
+def load_settings():
+    """Return the current Settings."""
+    conf = cfg.CONF['blazar:physical:host']
+    return Settings(**dict((opt.dest, conf[opt.dest]) for opt in opts))
+
+
+# Everything BlazarFilter needs to know about a request, derived once per
+# request so that deciding for a single host only takes a few lookups. The
+# decisions dict holds the reject reason, or None, of each pool signature
+# already checked for the request, the Pacer splits its hosts in chunks and
+# the DecisionSummary counts the rejections.
+DecisionContext = collections.namedtuple(
+    'DecisionContext', ['request_class', 'project_id', 'requested_pools',
+                        'preemptible_aggregate', 'decisions', 'pacer',
+                        'summary'])
+
+# Marks the pool signatures not checked yet, as None means passing
+_UNDECIDED = object()
+
+
+def classify_request(spec_obj, settings=None):
+    """Return the request class and the requested pools of a request."""
+    conf = settings or load_settings()
+
+    # Find which Pools the user wants to use (if any)
+    requested_pools = spec_obj.get_scheduler_hint('reservation')
+    if isinstance(requested_pools, str):
+        requested_pools = [requested_pools]
+
+    if requested_pools:
+        # the request is host reservation
+        return RESERVATION, requested_pools
+
+    extra_specs = spec_obj.flavor.extra_specs
+    if FLAVOR_EXTRA_SPEC in extra_specs:
+        # the request is instance reservation
+        return INSTANCE_RESERVATION, []
+
+    if conf.allow_preemptibles and bool_from_string(
+            extra_specs.get(FLAVOR_PREEMPTIBLE, False)):
+        # the request is for a preemptible instance and they are allowed
+        return PREEMPTIBLE, []
+
+    return PLAIN, []
+
+
+def reference_host_passes(host_state, spec_obj, settings):
+    """Check a host for a request from its aggregates only.
+
+    This is a copy of the original host by host implementation of the
+    filter, that the shadow mode compares BlazarFilter decisions against.
+    It shares no helper with BlazarFilter on purpose, so that a bug in the
+    classification of requests or aggregates shows up as a mismatch.
+    """
+    # Find which Pools the user wants to use (if any)
+    requested_pools = spec_obj.get_scheduler_hint('reservation')
+    if isinstance(requested_pools, str):
+        requested_pools = [requested_pools]
+
+    # Get any reservation pools this host is part of
+    # Note this include possibly the freepool
+    pools = []
+    for agg in host_state.aggregates:
+        if (agg.availability_zone and
+                str(agg.availability_zone).startswith(
+                    settings.blazar_az_prefix)
+                # NOTE(hiro-kobayashi): following 2 lines are for keeping
+                # backward compatibility
+                or str(agg.availability_zone).startswith('blazar:')):
+            pools.append(agg)
+
+        if agg.name in [settings.aggregate_freepool_name,
+                        settings.preemptible_aggregate]:
+            pools.append(agg)
+
+    # the request is host reservation
+    if requested_pools:
+        for pool in [p for p in pools if p.name in requested_pools]:
+            # Check tenant is allowed to use this Pool
+            if pool.metadata.get(spec_obj.project_id):
+                return True
+            owner_project_id = pool.metadata.get(settings.blazar_owner)
+            return owner_project_id == spec_obj.project_id
+        return False
+
+    extra_specs = spec_obj.flavor.extra_specs
+    # the request is instance reservation
+    if FLAVOR_EXTRA_SPEC in extra_specs.keys():
+        return True
+
+    preemptible = bool_from_string(
+        extra_specs.get(FLAVOR_PREEMPTIBLE, False))
+    # If the request is for a preemptible instance and they are allowed
+    if settings.allow_preemptibles and preemptible:
+        # Pass host if it only belongs to the preemptibles aggregate
+        return (len(pools) == 1 and
+                pools[0].name == settings.preemptible_aggregate)
+
+    return not pools
+
+
+# BlazarFilter instances whose settings are refreshed on config mutation
+_FILTERS = weakref.WeakSet()
+
+
+def _refresh_settings(conf, fresh):
+    if not any(group == 'blazar:physical:host' for group, _name in fresh):
+        return
+    for blazar_filter in list(_FILTERS):
+        blazar_filter.refresh_settings()
+
+
+cfg.CONF.register_mutate_hook(_refresh_settings)
+
+
+class Pacer(object):
+    """Hands the hosts of a request over in chunks.
+
+    Other green threads are let run between two chunks, so that a request
+    with many hosts does not hold the scheduler. Once the time budget of
+    the request is spent, the hosts left are rejected: the request fails
+    closed, only passing hosts which were checked.
+    """
+
+    def __init__(self, chunk_size=0, budget=0):
+        self.chunk_size = chunk_size
+        self.budget = budget
+        self.deadline = timeutils.now() + budget if budget else None
+        self.exceeded = False
+
+    def chunks(self, host_states, summary=None):
+        """Return the chunks of a list of hosts to check."""
+        size = self.chunk_size or len(host_states)
+        for start in range(0, len(host_states), size or 1):
+            if not self.exceeded and start:
+                # NOTE: time.sleep is made cooperative by eventlet, and
+                # releases the GIL otherwise.
+                time.sleep(0)
+            if (self.exceeded or self.deadline is not None and
+                    timeutils.now() > self.deadline):
+                self.exceeded = True
+                if summary is not None:
+                    summary.rejected[REJECT_TIME_BUDGET] += (
+                        len(host_states) - start)
+                return
+            yield host_states[start:start + size]
+
+
+class DecisionSummary(object):
+    """Counts of the hosts rejected for a request, by reason.
+
+    A few host names are kept for each reason so that the summary logged
+    once per request tells which hosts were rejected and why.
+    """
+
+    SAMPLES = 3
+
+    def __init__(self, log_hosts=False):
+        self.log_hosts = log_hosts
+        self.request_rejection = None
+        self.reset()
+
+    def reset(self):
+        self.rejected = collections.Counter()
+        self.samples = collections.defaultdict(list)
+
+    def reject(self, host_state, reason):
+        self.rejected[reason] += 1
+        samples = self.samples[reason]
+        if len(samples) < self.SAMPLES:
+            samples.append(host_state.host)
+        if self.log_hosts:
+            LOG.debug("Host %(host)s rejected: %(reason)s",
+                      {'host': host_state.host, 'reason': reason})
+
+    def log(self, context, hosts, passed):
+        # NOTE: Requests rejected as a whole are already logged with why
+        level = std_logging.DEBUG
+        if not passed and self.request_rejection is None:
+            level = std_logging.INFO
+        if not LOG.isEnabledFor(level):
+            return
+        rejections = []
+        for reason, count in sorted(self.rejected.items()):
+            samples = self.samples.get(reason)
+            if samples:
+                rejections.append('%s: %d (%s)' % (reason, count,
+                                                   ','.join(samples)))
+            else:
+                rejections.append('%s: %d' % (reason, count))
+        LOG.log(level, "%(request_class)s request of tenant %(tenant_id)s: "
+                       "%(passed)d of %(hosts)d hosts passed, rejected "
+                       "%(rejections)s",
+                {'request_class': context.request_class,
+                 'tenant_id': context.project_id,
+                 'passed': passed, 'hosts': hosts,
+                 'rejections': ', '.join(rejections) or 'none'})
+
 
 class BlazarFilter(filters.BaseHostFilter):
     """Blazar Filter for nova-scheduler."""
 
     run_filter_once_per_request = True
 
-    def fetch_blazar_pools(self, host_state):
+    def __init__(self):
+        super(BlazarFilter, self).__init__()
+        self.pool_index = pool_index.PoolIndex()
+        pool_index.watch_host_manager(self.pool_index)
+        self.refresh_settings()
+        _FILTERS.add(self)
+        self.result_cache = None
+        conf = self.settings
+        if conf.shared_index_path:
+            self.pool_index.shared = shared_index.SharedIndex(
+                conf.shared_index_path)
+        if conf.result_cache_size:
+            self.result_cache = result_cache.ResultCache(
+                conf.result_cache_size, conf.result_cache_ttl)
+        self.reservation_cache = None
+        if conf.reservation_cache_interval:
+            self.reservation_cache = reservation_cache.ReservationCache(
+                reservation_cache.BlazarClient.from_conf(),
+                conf.reservation_cache_interval,
+                conf.reservation_cache_max_age)
+        self.metrics = None
+        if conf.metrics_enabled:
+            self.metrics = metrics.FilterMetrics(
+                conf.metrics_textfile, conf.metrics_export_interval)
+
+        # NOTE: nova has no entry point for external request filters, so
+        # ours are added to the list of nova ones when the filter is loaded.
+        from blazarnova.scheduler import request_filter
+        request_filter.register()
+
+    def refresh_settings(self):
+        """Take a new snapshot of the options.
+
+        The cached classifications of aggregates are only dropped if the
+        options they depend on changed.
+        """
+        self.settings = load_settings()
+        self._sync_pool_index()
+
+    def _sync_pool_index(self):
+        conf = self.settings
+        self.pool_index.set_settings(conf.blazar_az_prefix,
+                                     conf.aggregate_freepool_name,
+                                     conf.preemptible_aggregate,
+                                     conf.blazar_owner)
+
+    def build_context(self, spec_obj):
+        """Build the DecisionContext of a request."""
+        conf = self.settings
+        request_class, requested_pools = classify_request(spec_obj, conf)
+
+        self._sync_pool_index()
+        self.pool_index.sync_shared()
+        return DecisionContext(
+            request_class=request_class,
+            project_id=spec_obj.project_id,
+            requested_pools=frozenset(requested_pools),
+            preemptible_aggregate=conf.preemptible_aggregate,
+            decisions={},
+            pacer=Pacer(conf.chunk_size, conf.time_budget),
+            summary=DecisionSummary(
+                log_hosts=(LOG.isEnabledFor(std_logging.DEBUG) and
+                           random.random() < conf.decision_log_sample_rate)))
+
+    @tracing.traced('BlazarFilter.fetch_blazar_pools',
+                    lambda self, host_state, context=None: {
+                        'host': host_state.host})
+    def fetch_blazar_pools(self, host_state, context=None):
         # Get any reservation pools this host is part of
         # Note this include possibly the freepool
-        aggregates = host_state.aggregates
+        if context is None:
+            self._sync_pool_index()
+
         pools = []
-        for agg in aggregates:
-            if (agg.availability_zone and
-                    str(agg.availability_zone).startswith(
-                        cfg.CONF['blazar:physical:host'].blazar_az_prefix)
-                    # NOTE(hiro-kobayashi): following 2 lines are for keeping
-                    # backward compatibility
-                    or str(agg.availability_zone).startswith('blazar:')):
+        for agg in host_state.aggregates:
+            info = self.pool_index.classify(agg)
+            if info.is_blazar_pool:
                 pools.append(agg)
-
-            if agg.name in [
-                    cfg.CONF['blazar:physical:host'].aggregate_freepool_name,
-                    cfg.CONF['blazar:physical:host'].preemptible_aggregate]:
+            if info.is_freepool or info.is_preemptible:
                 pools.append(agg)
 
         return pools
 
-    def host_reservation_request(self, host_state, spec_obj, requested_pools):
+    def host_reservation_request(self, host_state, spec_obj, requested_pools,
+                                 context=None):
+        if context is None:
+            context = self.build_context(spec_obj)
+        return self._reservation_reject_reason(
+            host_state, requested_pools, context) is None
 
-        pools = self.fetch_blazar_pools(host_state)
+    @tracing.traced('BlazarFilter.host_reservation_request',
+                    lambda self, host_state, requested_pools, context: {
+                        'host': host_state.host,
+                        'requested_pools': sorted(requested_pools)})
+    def _reservation_reject_reason(self, host_state, requested_pools,
+                                   context):
+        for agg in host_state.aggregates:
+            info = self.pool_index.classify(agg)
+            if not (info.is_managed and info.name in requested_pools):
+                continue
+            # Check tenant is allowed to use this Pool, either as its
+            # blazar:owner or as an extra project
+            if context.project_id in info.projects:
+                return None
+            return REJECT_UNAUTHORIZED
+        return REJECT_NOT_IN_POOL
 
-        for pool in [p for p in pools if p.name in requested_pools]:
-            # Check tenant is allowed to use this Pool
+    def filter_all(self, filter_obj_list, spec_obj):
+        """Return the hosts passing the filter.
 
-            # NOTE(sbauza): Currently, the key is only the project_id,
-            #  but later will possibly be blazar:tenant:{project_id}
-            key = spec_obj.project_id
-            access = pool.metadata.get(key)
-            if access:
-                return True
-            # NOTE(sbauza): We also need to check the blazar:owner key
-            #  until we modify the reservation pool for including the
-            #  project_id key as for any other extra project
-            owner = cfg.CONF['blazar:physical:host'].blazar_owner
-            owner_project_id = pool.metadata.get(owner)
-            if owner_project_id == spec_obj.project_id:
-                return True
-            LOG.info(_("Unauthorized request to use Pool "
-                       "%(pool_id)s by tenant %(tenant_id)s"),
-                     {'pool_id': pool.name,
-                      'tenant_id': spec_obj.project_id})
-            return False
-        return False
+        The request is only inspected once, then every host is checked
+        against the resulting DecisionContext.
+        """
+        # Do this here so we don't get scheduler.filters.utils
+        from nova.scheduler import utils
+        if not self.RUN_ON_REBUILD and utils.request_is_rebuild(spec_obj):
+            return list(filter_obj_list)
+
+        if self.reservation_cache is not None:
+            # NOTE: Started from here rather than on init, as nova creates
+            # the filters before forking the workers, which would not run
+            # the refresh thread.
+            self.reservation_cache.start()
+
+        start = timeutils.now()
+        host_states = list(filter_obj_list)
+        with tracing.span('BlazarFilter.filter_all',
+                          candidates=len(host_states)) as info:
+            context = self.build_context(spec_obj)
+            info['request_class'] = context.request_class
+            if context.request_class == INSTANCE_RESERVATION:
+                passing = host_states
+            elif self.result_cache is not None:
+                passing = self._filter_cached(host_states, context)
+            else:
+                passing = self._filter(host_states, context)
+            info['survivors'] = len(passing)
+
+        duration = timeutils.now() - start
+        if context.pacer.exceeded:
+            LOG.warning("The %(request_class)s request of tenant "
+                        "%(tenant_id)s exceeded the time budget of "
+                        "%(budget)ss, the hosts left were rejected: "
+                        "%(passed)d of %(hosts)d hosts passed",
+                        {'request_class': context.request_class,
+                         'tenant_id': context.project_id,
+                         'budget': context.pacer.budget,
+                         'passed': len(passing), 'hosts': len(host_states)})
+        if self.metrics is not None:
+            self._record_metrics(context, duration,
+                                 len(host_states), len(passing))
+        shadow_rate = self.settings.shadow_sample_rate
+        # The reference checks all the hosts, so it can only agree with
+        # requests whose hosts were all checked.
+        if (shadow_rate and self._hosts_checked(context) and
+                random.random() < shadow_rate):
+            self._shadow_check(host_states, spec_obj, context, passing,
+                               duration)
+        return passing
+
+    @staticmethod
+    def _hosts_checked(context):
+        """Whether the decisions of a request come from all its hosts.
+
+        They do not when the time budget ran out, nor when the request was
+        rejected from the cached state of its reservations, which changes
+        with time rather than with the aggregates.
+        """
+        return not (context.pacer.exceeded or
+                    context.summary.request_rejection == REJECT_INACTIVE)
+
+    def _shadow_check(self, host_states, spec_obj, context, passing,
+                      duration):
+        """Compare decisions with the ones of reference_host_passes."""
+        start = timeutils.now()
+        expected = [host_state for host_state in host_states
+                    if reference_host_passes(host_state, spec_obj,
+                                             self.settings)]
+        reference_duration = timeutils.now() - start
+
+        passed = set(host_state.host for host_state in passing)
+        expected_names = set(host_state.host for host_state in expected)
+        mismatch = passed != expected_names
+        if self.metrics is not None:
+            self.metrics.record_shadow(context.request_class, mismatch,
+                                       duration, reference_duration)
+        LOG.debug("Shadow check of %(request_class)s request: %(hosts)d "
+                  "hosts in %(duration).6fs, reference in "
+                  "%(reference).6fs",
+                  {'request_class': context.request_class,
+                   'hosts': len(host_states), 'duration': duration,
+                   'reference': reference_duration})
+        if not mismatch:
+            return
+
+        unexpected = passed - expected_names
+        missing = expected_names - passed
+        aggregates = dict(
+            (host_state.host,
+             [(agg.id if agg.obj_attr_is_set('id') else None, agg.name,
+               agg.metadata) for agg in host_state.aggregates])
+            for host_state in host_states
+            if host_state.host in unexpected or host_state.host in missing)
+        LOG.warning("BlazarFilter decisions differ from the reference for "
+                    "the %(request_class)s request of tenant %(tenant_id)s "
+                    "with hints %(hints)s and extra specs %(extra_specs)s "
+                    "(pool index generation %(generation)s): hosts passed "
+                    "unexpectedly %(unexpected)s, hosts rejected "
+                    "unexpectedly %(missing)s, aggregates %(aggregates)s",
+                    {'request_class': context.request_class,
+                     'tenant_id': context.project_id,
+                     'hints': spec_obj.scheduler_hints,
+                     'extra_specs': spec_obj.flavor.extra_specs,
+                     'generation': self.pool_index.snapshot.generation,
+                     'unexpected': sorted(unexpected),
+                     'missing': sorted(missing),
+                     'aggregates': aggregates})
+
+    def _record_metrics(self, context, duration, hosts_in, hosts_out):
+        self.metrics.record_request(context.request_class, duration,
+                                    hosts_in, hosts_out)
+        if context.pacer.exceeded:
+            self.metrics.inc('blazar_filter_time_budget_exceeded_total',
+                             (('request_class', context.request_class),))
+        if self.result_cache is not None:
+            stats = self.result_cache.stats()
+            for name in ('hits', 'misses', 'invalidations'):
+                self.metrics.set_counter(
+                    'blazar_filter_result_cache_%s_total' % name,
+                    stats[name])
+        if self.pool_index.warmup_duration is not None:
+            self.metrics.set_gauge('blazar_filter_index_warmup_seconds',
+                                   self.pool_index.warmup_duration)
+        self.metrics.maybe_export()
+
+    def _filter(self, host_states, context):
+        summary = context.summary
+        if context.request_class == RESERVATION:
+            passing = self._filter_reservation(host_states, context, summary)
+        else:
+            passing = self._filter_by_membership(host_states, context,
+                                                 summary)
+        summary.log(context, len(host_states), len(passing))
+        if self.metrics is not None:
+            self.metrics.record_rejections(summary.rejected,
+                                           summary.request_rejection)
+        return passing
+
+    def _filter_cached(self, host_states, context):
+        # The decisions only depend on the project for reservations
+        project_id = None
+        if context.request_class == RESERVATION:
+            project_id = context.project_id
+        key = (context.request_class, project_id, context.requested_pools)
+
+        # NOTE: The decisions are stored with the generation they started
+        # from, so that they are dropped if the index changed meanwhile.
+        generation = self.pool_index.snapshot.generation
+        decisions = self.result_cache.get(
+            key, generation, [host_state.host for host_state in host_states])
+        if decisions is not None:
+            return [host_state for host_state in host_states
+                    if decisions[host_state.host]]
+
+        passing = self._filter(host_states, context)
+        if not self._hosts_checked(context):
+            return passing
+        decisions = dict.fromkeys(
+            (host_state.host for host_state in host_states), False)
+        decisions.update(
+            (host_state.host, True) for host_state in passing)
+        self.result_cache.put(key, generation, decisions)
+        return passing
+
+    def _filter_by_membership(self, host_states, context, summary):
+        # Plain and preemptible requests only depend on the pools a host
+        # is in, which the index knows for all hosts once complete.
+        if context.request_class == PREEMPTIBLE:
+            kind, reason = membership.PREEMPTIBLE_ONLY, REJECT_NOT_PREEMPTIBLE
+        else:
+            kind, reason = membership.UNPOOLED, REJECT_IN_POOL
+        snapshot = self.pool_index.snapshot
+        if not snapshot.complete:
+            return self._check_hosts(host_states, context, summary)
+        passing = []
+        for chunk in context.pacer.chunks(host_states, summary):
+            selected = snapshot.select_hosts(chunk, kind)
+            if len(selected) < len(chunk):
+                summary.rejected[reason] += len(chunk) - len(selected)
+            passing.extend(selected)
+        return passing
+
+    def _check_hosts(self, host_states, context, summary):
+        """Check hosts one by one, in the chunks given by the Pacer."""
+        passing = []
+        for chunk in context.pacer.chunks(host_states, summary):
+            passing.extend(
+                host_state for host_state in chunk
+                if self.host_passes_context(host_state, context, summary))
+        return passing
+
+    def _filter_reservation(self, host_states, context, summary):
+        if (self.reservation_cache is not None and
+                self.reservation_cache.is_inactive(context.requested_pools)):
+            self._log_rejection(context, REJECT_INACTIVE, summary)
+            return []
+
+        # Only the hosts in the requested pools can pass, so check those
+        # first if the index knows them.
+        snapshot = self.pool_index.snapshot
+        members = snapshot.hosts_in_pools(context.requested_pools)
+        if members is None and snapshot.complete:
+            # All the aggregates are known, so the pools do not exist
+            self._log_rejection(context, REJECT_UNKNOWN_POOL, summary)
+            return []
+        candidates = []
+        if members:
+            candidates = [host_state for host_state in host_states
+                          if host_state.host in members]
+        if candidates:
+            # Refresh what is known of the requested pools from the
+            # aggregates of a current member before relying on it.
+            self.fetch_blazar_pools(candidates[0], context)
+            if not self._is_authorized(context):
+                self._log_rejection(context, REJECT_UNAUTHORIZED, summary)
+                return []
+
+            passing = self._check_hosts(candidates, context, summary)
+            # NOTE: The membership is refreshed while checking hosts whose
+            # aggregates have been updated. If that happened, or if no host
+            # passed while the index is not complete, the index may be
+            # stale so all hosts are checked.
+            generation = self.pool_index.snapshot.generation
+            if ((passing or snapshot.complete) and
+                    generation == snapshot.generation):
+                # Hosts outside of the requested pools were not checked
+                if len(candidates) < len(host_states):
+                    summary.rejected[REJECT_NOT_IN_POOL] += (
+                        len(host_states) - len(candidates))
+                return passing
+            summary.reset()
+        elif members is not None and snapshot.complete:
+            # The complete index knows all the members of the pools, and
+            # none of them is a candidate.
+            summary.rejected[REJECT_NOT_IN_POOL] += len(host_states)
+            return []
+
+        passing = self._check_hosts(host_states, context, summary)
+        if not passing and not context.pacer.exceeded:
+            if self.pool_index.hosts_in_pools(
+                    context.requested_pools) is None:
+                self._log_rejection(context, REJECT_UNKNOWN_POOL, summary)
+            elif not self._is_authorized(context):
+                self._log_rejection(context, REJECT_UNAUTHORIZED, summary)
+        return passing
+
+    def _is_authorized(self, context):
+        return bool(context.requested_pools &
+                    self.pool_index.authorized_pools(context.project_id))
+
+    def _log_rejection(self, context, reason, summary):
+        summary.request_rejection = reason
+        LOG.info(_("Rejected request of tenant %(tenant_id)s for Pools "
+                   "%(pool_ids)s: %(reason)s"),
+                 {'tenant_id': context.project_id,
+                  'pool_ids': ','.join(sorted(context.requested_pools)),
+                  'reason': reason})
 
     def host_passes(self, host_state, spec_obj):
         """Check if a host in a pool can be used for a request
@@ -123,44 +787,61 @@ class BlazarFilter(filters.BaseHostFilter):
             - or, "tenant_id=blazar:tenant" (which grants extra tenants for
                 the reservation)
         """
+        return self.host_passes_context(host_state,
+                                        self.build_context(spec_obj))
 
-        # Find which Pools the user wants to use (if any)
-        requested_pools = spec_obj.get_scheduler_hint('reservation')
-        if isinstance(requested_pools, str):
-            requested_pools = [requested_pools]
+    def pool_signature(self, host_state):
+        """Return the names of the Blazar managed aggregates of a host.
 
-        # the request is host reservation
-        if requested_pools:
-            return self.host_reservation_request(host_state, spec_obj,
-                                                 requested_pools)
+        The decisions for a host only depend on them, so the hosts with the
+        same signature get the same decisions.
+        """
+        classify = self.pool_index.classify
+        return tuple(info.name for info in map(classify, host_state.aggregates)
+                     if info.is_managed)
 
-        extra_specs = spec_obj.flavor.extra_specs
-        # the request is instance reservation
-        if FLAVOR_EXTRA_SPEC in extra_specs.keys():
+    def host_passes_context(self, host_state, context, summary=None):
+        """Check a host against an already built DecisionContext.
+
+        The reason the host is rejected, if it is, is added to the
+        DecisionSummary of the request. Only the first host of each pool
+        signature is actually checked.
+        """
+        signature = self.pool_signature(host_state)
+        reason = context.decisions.get(signature, _UNDECIDED)
+        if reason is _UNDECIDED:
+            reason = self._reject_reason(host_state, context)
+            context.decisions[signature] = reason
+        if reason is None:
+            return True
+        if summary is not None:
+            summary.reject(host_state, reason)
+        return False
+
+    def _reject_reason(self, host_state, context):
+        if context.request_class == RESERVATION:
+            return self._reservation_reject_reason(
+                host_state, context.requested_pools, context)
+
+        if context.request_class == INSTANCE_RESERVATION:
             # Scheduling requests for instance reservation are processed by
             # other Nova filters: AggregateInstanceExtraSpecsFilter,
             # AggregateMultiTenancyIsolation, and
             # ServerGroupAntiAffinityFilter. What BlazarFilter needs to
             # do is just pass the host if the request has an instance
             # reservation key.
-            return True
+            return None
 
-        allow_preempt = cfg.CONF['blazar:physical:host'].allow_preemptibles
-        preemptible = bool_from_string(
-            extra_specs.get(FLAVOR_PREEMPTIBLE, False))
-        blazar_pools = self.fetch_blazar_pools(host_state)
-        # If the request is for a preemptible instance and they are allowed
-        if allow_preempt and preemptible:
+        blazar_pools = self.fetch_blazar_pools(host_state, context)
+        if context.request_class == PREEMPTIBLE:
             if (len(blazar_pools) == 1 and blazar_pools[0].name ==
-                    cfg.CONF['blazar:physical:host'].preemptible_aggregate):
+                    context.preemptible_aggregate):
                 # Pass host if it only belongs to the preemptibles aggregate
-                LOG.info("Host %s allowed for preemptibles" % host_state)
-                return True
-            return False
+                return None
+            return REJECT_NOT_PREEMPTIBLE
 
         if blazar_pools:
             # Host is in a blazar pool and non reservation request
-            LOG.info("Host is in a reservation aggregate or in the freepool")
-            return False
+            return REJECT_IN_POOL
 
-        return True
+        return None
@@ -0,0 +1,244 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compact membership of hosts in Blazar pools."""
+
+import array
+
+# Kinds of hosts, by the Blazar pools they are in
+UNPOOLED = 0
+PREEMPTIBLE_ONLY = 1
+POOLED = 2
+
+
+class MembershipMatrix(object):
+    """Membership of hosts in Blazar pools.
+
+    Host and pool names are interned to small integers. The members of
+    each pool are kept as a bitset of host ids, and the kind of each host
+    in a bytearray indexed by host id. The names of the hosts of each kind
+    are derived from it when first needed, so that the hosts of a kind are
+    selected from a candidate list with one set lookup per host.
+
+    Host id 0 is never assigned, it stands for the hosts which were never
+    seen in a pool and so are UNPOOLED.
+
+    Views of a matrix share its structures, which the matrix copies before
+    its next change, so that a view never changes.
+    """
+
+    def __init__(self):
+        # Dict of host ID keyed by host name, and list of host names
+        self._host_ids = {}
+        self._host_names = [None]
+        # Dict of (bitset of host IDs, weight, is_preemptible) keyed by
+        # pool name
+        self._pools = {}
+        # Number of pools each host is in, counting twice the aggregates
+        # which are both a reservation pool and the freepool or the
+        # preemptible aggregate, as fetch_blazar_pools does
+        self._weights = array.array('H', [0])
+        # Number of preemptible aggregates each host is in
+        self._preemptibles = array.array('H', [0])
+        self.kinds = bytearray(1)
+        # Frozensets of host names keyed by kind, and of the hosts in any
+        # pool keyed by 'pooled', reset on changes
+        self._kind_hosts = {}
+        # Whether the structures are shared with a view or a buffer
+        self._shared = False
+
+    def __len__(self):
+        return len(self._pools)
+
+    def _host_id(self, name):
+        host_id = self._host_ids.get(name)
+        if host_id is None:
+            host_id = len(self._host_names)
+            self._host_ids[name] = host_id
+            self._host_names.append(name)
+            self._weights.append(0)
+            self._preemptibles.append(0)
+            self.kinds.append(UNPOOLED)
+        return host_id
+
+    def _update_host(self, host_id, weight, preemptible):
+        self._weights[host_id] += weight
+        self._preemptibles[host_id] += preemptible
+        total = self._weights[host_id]
+        if not total:
+            kind = UNPOOLED
+        elif total == 1 and self._preemptibles[host_id]:
+            kind = PREEMPTIBLE_ONLY
+        else:
+            kind = POOLED
+        self.kinds[host_id] = kind
+
+    def _members(self, bits):
+        names = self._host_names
+        members = []
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        for index, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                members.append(names[index * 8 + low.bit_length() - 1])
+                byte ^= low
+        return members
+
+    def _bits(self, hosts):
+        host_ids = [self._host_id(host) for host in hosts]
+        if not host_ids:
+            return 0
+        # NOTE: Setting the bits of a bytearray avoids building a new
+        # integer for each host.
+        data = bytearray(max(host_ids) // 8 + 1)
+        for host_id in host_ids:
+            data[host_id >> 3] |= 1 << (host_id & 7)
+        return int.from_bytes(data, 'little')
+
+    def to_buffers(self):
+        """Return the state of the matrix as metadata and raw arrays."""
+        meta = {
+            'hosts': self._host_names[1:],
+            'pools': dict((name, ['%x' % bits, weight, preemptible])
+                          for name, (bits, weight, preemptible)
+                          in self._pools.items()),
+        }
+        return meta, (bytes(self.kinds), self._weights.tobytes(),
+                      self._preemptibles.tobytes())
+
+    @classmethod
+    def from_buffers(cls, meta, kinds, weights, preemptibles):
+        """Return a matrix from the result of to_buffers.
+
+        The arrays may be read-only memoryviews of a shared buffer, which
+        are only copied if the matrix is changed.
+        """
+        matrix = cls()
+        matrix._host_names = [None] + list(meta['hosts'])
+        matrix._host_ids = dict(
+            (name, host_id)
+            for host_id, name in enumerate(matrix._host_names) if host_id)
+        matrix._pools = dict((name, (int(bits, 16), weight, preemptible))
+                             for name, (bits, weight, preemptible)
+                             in meta['pools'].items())
+        matrix.kinds = kinds
+        matrix._weights = weights.cast('H')
+        matrix._preemptibles = preemptibles.cast('H')
+        matrix._shared = True
+        return matrix
+
+    def view(self):
+        """Return a matrix which will not see the next changes."""
+        matrix = MembershipMatrix.__new__(MembershipMatrix)
+        matrix.__dict__.update(self.__dict__)
+        matrix._shared = self._shared = True
+        return matrix
+
+    def _unshare(self):
+        if self._shared:
+            self._host_ids = dict(self._host_ids)
+            self._host_names = list(self._host_names)
+            self._pools = dict(self._pools)
+            self.kinds = bytearray(self.kinds)
+            self._weights = array.array('H', self._weights.tobytes())
+            self._preemptibles = array.array('H',
+                                             self._preemptibles.tobytes())
+            self._shared = False
+
+    def set_pool(self, name, hosts, weight=1, is_preemptible=False):
+        """Set the hosts of a pool. Returns whether anything changed."""
+        preemptible = int(is_preemptible and weight == 1)
+        old = self._pools.get(name)
+        bits = None
+        host_ids = self._host_ids
+        if all(host in host_ids for host in hosts):
+            # Known hosts are not interned again, so the structures shared
+            # with the views are only copied if the pool changed.
+            bits = self._bits(hosts)
+            if old == (bits, weight, preemptible):
+                return False
+
+        self._unshare()
+        self._kind_hosts = {}
+        if bits is None:
+            bits = self._bits(hosts)
+        if old is not None:
+            old_bits, old_weight, old_preemptible = old
+            if (old_weight, old_preemptible) == (weight, preemptible):
+                # Only update the hosts which joined or left the pool
+                for host in self._members(old_bits & ~bits):
+                    self._update_host(self._host_ids[host], -weight,
+                                      -preemptible)
+                bits_added = bits & ~old_bits
+                self._pools[name] = (bits, weight, preemptible)
+                for host in self._members(bits_added):
+                    self._update_host(self._host_ids[host], weight,
+                                      preemptible)
+                return True
+            self.remove_pool(name)
+
+        self._pools[name] = (bits, weight, preemptible)
+        for host in self._members(bits):
+            self._update_host(self._host_ids[host], weight, preemptible)
+        return True
+
+    def remove_pool(self, name):
+        """Forget a pool. Returns whether it was known."""
+        if name not in self._pools:
+            return False
+        self._unshare()
+        self._kind_hosts = {}
+        old = self._pools.pop(name)
+        bits, weight, preemptible = old
+        for host in self._members(bits):
+            self._update_host(self._host_ids[host], -weight, -preemptible)
+        return True
+
+    def hosts_in(self, pool_names):
+        """Return the names of the hosts in any of the pools, or None.
+
+        None is returned if any of the pools is not known.
+        """
+        bits = 0
+        for name in pool_names:
+            pool = self._pools.get(name)
+            if pool is None:
+                return None
+            bits |= pool[0]
+        return set(self._members(bits))
+
+    def hosts_of_kind(self, kind):
+        """Return the names of the known hosts of a kind, as a frozenset."""
+        hosts = self._kind_hosts.get(kind)
+        if hosts is None:
+            kinds = self.kinds
+            hosts = frozenset(name for host_id, name
+                              in enumerate(self._host_names)
+                              if host_id and kinds[host_id] == kind)
+            self._kind_hosts[kind] = hosts
+        return hosts
+
+    def select(self, host_states, kind):
+        """Return the host states of the hosts of a kind."""
+        if kind != UNPOOLED:
+            members = self.hosts_of_kind(kind)
+            return [host_state for host_state in host_states
+                    if host_state.host in members]
+        # Hosts never seen in a pool are unpooled too, so rule out the
+        # hosts in a pool instead.
+        pooled = self._kind_hosts.get('pooled')
+        if pooled is None:
+            pooled = (self.hosts_of_kind(PREEMPTIBLE_ONLY) |
+                      self.hosts_of_kind(POOLED))
+            self._kind_hosts['pooled'] = pooled
+        return [host_state for host_state in host_states
+                if host_state.host not in pooled]
@@ -0,0 +1,316 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Metrics of BlazarFilter in the Prometheus text exposition format."""
+
+import atexit
+import bisect
+import collections
+import glob
+import os
+import threading
+
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+LOG = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5)
+HOSTS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 50000, 100000)
+
+# Functions called with the rendered metrics each time they are exported
+_CALLBACKS = []
+
+
+def register_callback(callback):
+    """Call a function with the metrics text each time it is exported."""
+    if callback not in _CALLBACKS:
+        _CALLBACKS.append(callback)
+
+
+def unregister_callback(callback):
+    """Stop calling a function registered with register_callback."""
+    if callback in _CALLBACKS:
+        _CALLBACKS.remove(callback)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def _value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _with_labels(text, labels):
+    """Return rendered metrics with labels added first to all the series."""
+    added = _labels(labels)[1:-1]
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, sep, rest = line.partition('{')
+            if sep:
+                line = '%s{%s,%s' % (name, added, rest)
+            else:
+                name, value = line.rsplit(' ', 1)
+                line = '%s{%s} %s' % (name, added, value)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+class FilterMetrics(object):
+    """Counters and histograms of the BlazarFilter decisions.
+
+    They are exported, at most every export_interval seconds, to the
+    textfile path if set, for the textfile collector of the Prometheus
+    node exporter, and to the functions registered with register_callback.
+
+    As each nova-scheduler worker has its own metrics, the textfile of a
+    process has its pid inserted before the extension, and its series get
+    a pid label, so that the workers do not overwrite each other's file
+    and the collector does not see the same series twice. A process
+    removes its file when it exits, and the files left by the processes
+    which are gone when it first exports its metrics.
+    """
+
+    COUNTERS = {
+        'blazar_filter_requests_total':
+            'Requests filtered by BlazarFilter, by request class.',
+        'blazar_filter_host_rejections_total':
+            'Hosts rejected by BlazarFilter, by reason.',
+        'blazar_filter_request_rejections_total':
+            'Reservation requests rejected as a whole, by reason.',
+        'blazar_filter_result_cache_hits_total':
+            'Requests whose decisions were found in the result cache.',
+        'blazar_filter_result_cache_misses_total':
+            'Requests whose decisions were not in the result cache.',
+        'blazar_filter_result_cache_invalidations_total':
+            'Times the result cache was dropped on aggregate changes.',
+        'blazar_filter_time_budget_exceeded_total':
+            'Requests whose hosts were not all checked within the time '
+            'budget.',
+        'blazar_filter_shadow_requests_total':
+            'Requests also checked with the reference implementation.',
+        'blazar_filter_shadow_mismatches_total':
+            'Shadow checked requests with different decisions.',
+        'blazar_filter_shadow_seconds_total':
+            'Time spent filtering the shadow checked requests, by '
+            'implementation.',
+    }
+    GAUGES = {
+        'blazar_filter_index_warmup_seconds':
+            'Time taken by the last warm up of the pool index.',
+    }
+    HISTOGRAMS = {
+        'blazar_filter_duration_seconds':
+            ('Time spent filtering the hosts of a request.',
+             DURATION_BUCKETS),
+        'blazar_filter_hosts_in':
+            ('Hosts given to BlazarFilter for a request.', HOSTS_BUCKETS),
+        'blazar_filter_hosts_out':
+            ('Hosts passing BlazarFilter for a request.', HOSTS_BUCKETS),
+    }
+
+    def __init__(self, textfile=None, export_interval=15):
+        self.textfile = textfile
+        self.export_interval = export_interval
+        self._next_export = 0
+        # Process which last cleaned up the textfiles
+        self._textfile_pid = None
+        # Dicts keyed by metric name then by tuple of (label, value)
+        self._counters = collections.defaultdict(collections.Counter)
+        self._gauges = collections.defaultdict(dict)
+        self._histograms = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[name][labels] += value
+
+    def set_counter(self, name, value, labels=()):
+        """Set a counter maintained elsewhere, like the cache statistics."""
+        with self._lock:
+            self._counters[name][labels] = value
+
+    def set_gauge(self, name, value, labels=()):
+        with self._lock:
+            self._gauges[name][labels] = value
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            histogram = self._histograms[name].get(labels)
+            if histogram is None:
+                histogram = Histogram(self.HISTOGRAMS[name][1])
+                self._histograms[name][labels] = histogram
+            histogram.observe(value)
+
+    def record_request(self, request_class, duration, hosts_in, hosts_out):
+        """Record the outcome of a filtered request."""
+        labels = (('request_class', request_class),)
+        with self._lock:
+            self._counters['blazar_filter_requests_total'][labels] += 1
+        self.observe('blazar_filter_duration_seconds', duration, labels)
+        self.observe('blazar_filter_hosts_in', hosts_in, labels)
+        self.observe('blazar_filter_hosts_out', hosts_out, labels)
+
+    def record_rejections(self, rejected, request_rejection=None):
+        """Record the host and request rejections of a DecisionSummary."""
+        with self._lock:
+            for reason, count in rejected.items():
+                self._counters['blazar_filter_host_rejections_total'][
+                    (('reason', reason),)] += count
+            if request_rejection is not None:
+                self._counters['blazar_filter_request_rejections_total'][
+                    (('reason', request_rejection),)] += 1
+
+    def record_shadow(self, request_class, mismatch, duration,
+                      reference_duration):
+        """Record the outcome of a shadow check."""
+        labels = (('request_class', request_class),)
+        with self._lock:
+            self._counters['blazar_filter_shadow_requests_total'][
+                labels] += 1
+            if mismatch:
+                self._counters['blazar_filter_shadow_mismatches_total'][
+                    labels] += 1
+            seconds = self._counters['blazar_filter_shadow_seconds_total']
+            seconds[labels + (('implementation', 'filter'),)] += duration
+            seconds[labels + (('implementation', 'reference'),)] += (
+                reference_duration)
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                help_text = self.COUNTERS[name]
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s counter' % name)
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append('%s%s %s' % (
+                        name, _labels(labels), _value(value)))
+            for name in sorted(self._gauges):
+                lines.append('# HELP %s %s' % (name, self.GAUGES[name]))
+                lines.append('# TYPE %s gauge' % name)
+                for labels, value in sorted(self._gauges[name].items()):
+                    lines.append('%s%s %s' % (
+                        name, _labels(labels), _value(value)))
+            for name in sorted(self._histograms):
+                lines.append('# HELP %s %s' % (name, self.HISTOGRAMS[name][0]))
+                lines.append('# TYPE %s histogram' % name)
+                for labels, histogram in sorted(
+                        self._histograms[name].items()):
+                    cumulative = 0
+                    bounds = [_value(bound) for bound in histogram.buckets]
+                    for bound, count in zip(bounds + ['+Inf'],
+                                            histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (
+                            name, _labels(labels + (('le', bound),)),
+                            cumulative))
+                    lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                                  _value(histogram.sum)))
+                    lines.append('%s_count%s %d' % (name, _labels(labels),
+                                                    histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def maybe_export(self):
+        """Export the metrics if they were not for export_interval."""
+        now = timeutils.now()
+        if now < self._next_export:
+            return
+        self._next_export = now + self.export_interval
+        self.export()
+
+    def process_textfile(self):
+        """Return the path of the textfile of this process."""
+        # NOTE: The pid is looked up on each export as the workers are
+        # forked after the filter, and so its metrics, are created.
+        root, ext = os.path.splitext(self.textfile)
+        return '%s.%d%s' % (root, os.getpid(), ext)
+
+    def _clean_up_textfiles(self):
+        """Remove the textfiles of the processes which are gone.
+
+        The textfile of this process is removed when it exits, which the
+        forked workers only do if they exit normally.
+        """
+        self._textfile_pid = os.getpid()
+        atexit.register(self._remove_textfile, self.process_textfile())
+        root, ext = os.path.splitext(self.textfile)
+        for path in glob.glob('%s.*%s' % (glob.escape(root), ext)):
+            pid = path[len(root) + 1:len(path) - len(ext)]
+            if not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                self._remove_textfile(path)
+            except OSError:
+                # A process of another user
+                pass
+
+    @staticmethod
+    def _remove_textfile(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            LOG.exception('Failed to remove the BlazarFilter metrics file %s',
+                          path)
+
+    def export(self):
+        """Write the metrics to the textfile and pass them to callbacks."""
+        text = self.render()
+        if self.textfile:
+            if self._textfile_pid != os.getpid():
+                self._clean_up_textfiles()
+            path = self.process_textfile()
+            # Replace the file at once so that it is never read half written
+            tmp_path = '%s.tmp' % path
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(_with_labels(text, (('pid', os.getpid()),)))
+                os.replace(tmp_path, path)
+            except OSError:
+                LOG.exception('Failed to write BlazarFilter metrics to %s',
+                              path)
+        for callback in list(_CALLBACKS):
+            try:
+                callback(text)
+            except Exception:
+                LOG.exception('BlazarFilter metrics callback %s failed',
+                              callback)
@@ -0,0 +1,507 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Caches of the Blazar view of nova host aggregates."""
+
+import collections
+import functools
+import threading
+import weakref
+
+from blazarnova.scheduler.filters import membership
+from blazarnova.scheduler.filters import tracing
+
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+LOG = logging.getLogger(__name__)
+
+
+class PoolInfo(collections.namedtuple(
+        'PoolInfo',
+        ['name', 'is_blazar_pool', 'is_freepool', 'is_preemptible',
+         'projects'])):
+    """What Blazar makes of a host aggregate."""
+
+    __slots__ = ()
+
+    @property
+    def is_managed(self):
+        """Whether the hosts of the aggregate are managed by Blazar."""
+        return self.is_blazar_pool or self.is_freepool or self.is_preemptible
+
+
+def classify_aggregate(aggregate, az_prefix, freepool_name,
+                       preemptible_aggregate, blazar_owner):
+    """Return the PoolInfo of an aggregate."""
+    az = aggregate.availability_zone
+    is_blazar_pool = bool(
+        az and str(az).startswith(az_prefix)
+        # NOTE(hiro-kobayashi): following 2 lines are for keeping
+        # backward compatibility
+        or str(az).startswith('blazar:'))
+    is_freepool = aggregate.name == freepool_name
+    is_preemptible = aggregate.name == preemptible_aggregate
+
+    projects = set()
+    if is_blazar_pool or is_freepool or is_preemptible:
+        metadata = aggregate.metadata or {}
+        # NOTE(sbauza): Currently, the key is only the project_id,
+        #  but later will possibly be blazar:tenant:{project_id}
+        # The keys set by nova and Blazar themselves are not projects.
+        projects.update(key for key, value in metadata.items()
+                        if value and key != 'availability_zone' and
+                        key != blazar_owner and
+                        not key.startswith('blazar:'))
+        # NOTE(sbauza): We also need to check the blazar:owner key
+        #  until we modify the reservation pool for including the
+        #  project_id key as for any other extra project
+        if metadata.get(blazar_owner):
+            projects.add(metadata[blazar_owner])
+
+    return PoolInfo(name=aggregate.name,
+                    is_blazar_pool=is_blazar_pool,
+                    is_freepool=is_freepool,
+                    is_preemptible=is_preemptible,
+                    projects=frozenset(projects))
+
+
+class Snapshot(collections.namedtuple(
+        'Snapshot',
+        ['generation', 'settings', 'complete', 'membership',
+         'pools_by_project'])):
+    """State of a PoolIndex at one generation, which never changes."""
+
+    __slots__ = ()
+
+    def authorized_pools(self, project_id):
+        """Return the names of the known pools a project can use."""
+        return self.pools_by_project.get(project_id, frozenset())
+
+    def hosts_in_pools(self, pool_names):
+        """Return the names of the hosts known to be in any of the pools.
+
+        Returns None if the membership of any of the pools is not known.
+        """
+        return self.membership.hosts_in(pool_names)
+
+    def select_hosts(self, host_states, kind):
+        """Return the host states of the hosts of a membership kind.
+
+        Returns None if the index is not complete.
+        """
+        if not self.complete:
+            return None
+        return self.membership.select(host_states, kind)
+
+
+def _writes(fn):
+    """Decorate a PoolIndex method changing its state.
+
+    The changes are made under the lock of the index, and a new snapshot
+    is published once the outermost change is done.
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            self._writers += 1
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                self._writers -= 1
+                if not self._writers:
+                    self._publish()
+    return wrapper
+
+
+class PoolIndex(object):
+    """Classification cache of host aggregates.
+
+    Aggregates are shared by many hosts and rarely change, so each of them
+    is classified once and the result is kept, keyed by aggregate id, until
+    its name or metadata change.
+
+    The index also keeps, as learnt from the classified aggregates, the
+    membership of the hosts in the Blazar pools and the names of the pools
+    each project is allowed to use. The generation is bumped each time a
+    change of the aggregates is seen.
+
+    Once all the aggregates have been loaded, the index is complete: a host
+    in none of the known pools is in no pool at all.
+
+    Scheduling threads read the index through its current snapshot, which
+    is replaced as a whole after each change, so they never take a lock nor
+    see a change half made. Only the changes, which are rare, are
+    serialized.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._writers = 0
+        self._settings = None
+        # Dict of (aggregate, fingerprint, PoolInfo) keyed by aggregate ID
+        self._pool_infos = {}
+        # Membership of the hosts in the Blazar pools
+        self._membership = membership.MembershipMatrix()
+        # Dict of set of Blazar pool names keyed by authorized project ID
+        self._pools_by_project = collections.defaultdict(set)
+        self.complete = False
+        self.generation = 0
+        # SharedIndex the index is published to or adopted from, if any
+        self.shared = None
+        # Seconds taken by the last warm up
+        self.warmup_duration = None
+        self._publish()
+
+    def _publish(self):
+        # NOTE: Replacing the attribute is atomic, readers either get the
+        # previous snapshot or this one.
+        self.snapshot = Snapshot(
+            generation=self.generation,
+            settings=self._settings,
+            complete=self.complete,
+            membership=self._membership.view(),
+            pools_by_project=dict(
+                (project_id, frozenset(pools))
+                for project_id, pools in self._pools_by_project.items()))
+
+    def set_settings(self, az_prefix, freepool_name, preemptible_aggregate,
+                     blazar_owner):
+        """Set the options used for classifying aggregates.
+
+        Changing any of them drops the cached classifications.
+        """
+        settings = (az_prefix, freepool_name, preemptible_aggregate,
+                    blazar_owner)
+        if settings != self._settings:
+            self._change_settings(settings)
+
+    @_writes
+    def _change_settings(self, settings):
+        if settings == self._settings:
+            # Another thread was first
+            return
+        with tracing.span('PoolIndex.rebuild',
+                          dropped=len(self._pool_infos)):
+            self._reset(settings)
+
+    def _reset(self, settings):
+        aggregates = [entry[0] for entry in self._pool_infos.values()]
+        complete = self.complete
+        self._settings = settings
+        self._pool_infos = {}
+        self._membership = membership.MembershipMatrix()
+        self._pools_by_project = collections.defaultdict(set)
+        self.complete = False
+        self.generation += 1
+        if complete and settings is not None:
+            # All the aggregates are known, so classify them again now
+            self.load_aggregates(aggregates)
+
+    @staticmethod
+    def _fingerprint(aggregate):
+        return aggregate.name, sorted((aggregate.metadata or {}).items())
+
+    def classify(self, aggregate):
+        """Return the PoolInfo of an aggregate, from the cache if valid."""
+        if not aggregate.obj_attr_is_set('id'):
+            return classify_aggregate(aggregate, *self._settings)
+
+        entry = self._pool_infos.get(aggregate.id)
+        # NOTE: The HostManager hands the same aggregate object to all
+        # hosts, so this is the common case.
+        if entry is not None and entry[0] is aggregate:
+            return entry[2]
+        return self._classify(aggregate)
+
+    @_writes
+    def _classify(self, aggregate):
+        entry = self._pool_infos.get(aggregate.id)
+        if entry is not None:
+            cached, fingerprint, info = entry
+            if cached is aggregate:
+                return info
+            if fingerprint == self._fingerprint(aggregate):
+                self._pool_infos[aggregate.id] = (aggregate, fingerprint,
+                                                  info)
+                self._update_hosts(aggregate, info)
+                return info
+            self._forget_pool(info)
+
+        info = classify_aggregate(aggregate, *self._settings)
+        self._pool_infos[aggregate.id] = (aggregate,
+                                          self._fingerprint(aggregate), info)
+        if entry is not None:
+            self.generation += 1
+        for project_id in info.projects:
+            self._pools_by_project[project_id].add(info.name)
+        self._update_hosts(aggregate, info)
+        return info
+
+    def _update_hosts(self, aggregate, info):
+        if not info.is_managed:
+            return
+        if not aggregate.obj_attr_is_set('hosts'):
+            # The hosts of this pool are unknown
+            self.complete = False
+            return
+        weight = int(info.is_blazar_pool) + int(info.is_freepool or
+                                                info.is_preemptible)
+        if self._membership.set_pool(info.name, aggregate.hosts or [],
+                                     weight, info.is_preemptible):
+            self.generation += 1
+
+    def _forget_pool(self, info):
+        for project_id in info.projects:
+            pools = self._pools_by_project.get(project_id)
+            if pools is not None:
+                pools.discard(info.name)
+                if not pools:
+                    del self._pools_by_project[project_id]
+        if self._membership.remove_pool(info.name):
+            self.generation += 1
+
+    @_writes
+    def forget(self, aggregate_id):
+        """Drop the cached classification of an aggregate."""
+        entry = self._pool_infos.pop(aggregate_id, None)
+        if entry is not None:
+            self._forget_pool(entry[2])
+            self.generation += 1
+
+    @_writes
+    def update_aggregates(self, aggregates):
+        """Apply aggregate creations and updates to the index."""
+        if self._settings is None:
+            # Nothing is known yet, aggregates will be classified when seen
+            return
+        with tracing.span('PoolIndex.update_aggregates') as info:
+            generation = self.generation
+            for aggregate in aggregates:
+                self.classify(aggregate)
+            info['aggregates'] = len(aggregates)
+            info['changed'] = generation != self.generation
+
+    @_writes
+    def load_aggregates(self, aggregates):
+        """Classify all the aggregates, making the index complete."""
+        if self._settings is None:
+            return
+        if self.sync_shared(publish=False):
+            # Another worker already did it
+            return
+        with tracing.span('PoolIndex.load_aggregates',
+                          aggregates=len(aggregates)):
+            known = set(self._pool_infos)
+            self.complete = True
+            for aggregate in aggregates:
+                known.discard(aggregate.id)
+                self.classify(aggregate)
+            for aggregate_id in known:
+                self.forget(aggregate_id)
+            self.generation += 1
+
+    def warm_up(self, aggregates):
+        """Build the index from all the aggregates before any request.
+
+        A failure is logged and leaves the index to be built lazily, from
+        the aggregates of the hosts being filtered.
+        """
+        if self._settings is None:
+            return
+        start = timeutils.now()
+        try:
+            self.load_aggregates(aggregates)
+        except Exception:
+            LOG.exception('Failed to warm up the Blazar pool index, it will '
+                          'be built while filtering hosts.')
+            self.drop()
+            return
+        self.warmup_duration = timeutils.now() - start
+        snapshot = self.snapshot
+        LOG.info('Warmed up the Blazar pool index with %(aggregates)d '
+                 'aggregates, %(pools)d of them Blazar managed, in '
+                 '%(duration).3fs.',
+                 {'aggregates': len(aggregates),
+                  'pools': len(snapshot.membership),
+                  'duration': self.warmup_duration})
+
+    @_writes
+    def drop(self):
+        """Forget all the aggregates, the index is then built lazily."""
+        self.complete = False
+        self._reset(self._settings)
+
+    @_writes
+    def delete_aggregate(self, aggregate):
+        """Apply an aggregate deletion to the index."""
+        if aggregate.id in self._pool_infos or self._settings is None:
+            self.forget(aggregate.id)
+        else:
+            # Classified by the worker the index was adopted from
+            self._forget_pool(classify_aggregate(aggregate, *self._settings))
+
+    def export_state(self, snapshot):
+        """Return the state of a snapshot as metadata and raw arrays."""
+        meta, buffers = snapshot.membership.to_buffers()
+        meta['settings'] = snapshot.settings
+        meta['complete'] = snapshot.complete
+        meta['projects'] = dict((project_id, sorted(pools))
+                                for project_id, pools
+                                in snapshot.pools_by_project.items())
+        return meta, buffers
+
+    @_writes
+    def adopt_state(self, meta, buffers):
+        """Replace the state by one exported by another index.
+
+        Returns False if it was built with other settings.
+        """
+        if tuple(meta['settings'] or ()) != tuple(self._settings or ()):
+            return False
+        self._membership = membership.MembershipMatrix.from_buffers(
+            meta, *buffers)
+        self._pools_by_project = collections.defaultdict(set)
+        for project_id, pools in meta['projects'].items():
+            self._pools_by_project[project_id].update(pools)
+        self.complete = meta['complete']
+        self.generation += 1
+        return True
+
+    def sync_shared(self, publish=True):
+        """Publish the state or adopt the published one, if shared.
+
+        With publish False, the state of a publisher is not written, as
+        it is about to change.
+
+        Returns whether the published state was adopted.
+        """
+        shared = self.shared
+        if shared is None or self._settings is None:
+            return False
+        try:
+            publisher = shared.try_publish()
+        except OSError:
+            LOG.exception('Failed to open the lock of the shared Blazar pool '
+                          'index %s, this worker uses its own index.',
+                          shared.path)
+            self.shared = None
+            return False
+        try:
+            if publisher:
+                snapshot = self.snapshot
+                if (publish and
+                        shared.published_generation != snapshot.generation):
+                    shared.publish(self, snapshot)
+                return False
+            return shared.refresh(self)
+        except Exception:
+            LOG.exception('Failed to share the Blazar pool index through '
+                          '%s, using the one of this worker.', shared.path)
+            return False
+
+    def authorized_pools(self, project_id):
+        """Return the names of the known pools a project can use."""
+        return self.snapshot.authorized_pools(project_id)
+
+    def hosts_in_pools(self, pool_names):
+        """Return the names of the hosts known to be in any of the pools.
+
+        Returns None if the membership of any of the pools is not known.
+        """
+        return self.snapshot.hosts_in_pools(pool_names)
+
+    def select_hosts(self, host_states, kind):
+        """Return the host states of the hosts of a membership kind.
+
+        Returns None if the index is not complete.
+        """
+        return self.snapshot.select_hosts(host_states, kind)
+
+
+# PoolIndex instances kept up to date with the HostManager aggregates
+_WATCHING_INDEXES = weakref.WeakSet()
+# Original HostManager methods keyed by name, while they are wrapped
+_WRAPPED_METHODS = {}
+
+
+def _notify_indexes(method_name, arg):
+    for index in list(_WATCHING_INDEXES):
+        try:
+            index.sync_shared(publish=False)
+            shared = index.shared
+            if (shared is not None and shared.adopted and
+                    not shared.publisher):
+                # The publisher gets the same changes, and the reader
+                # adopts them once published.
+                continue
+            getattr(index, method_name)(arg)
+            index.sync_shared()
+        except Exception:
+            LOG.exception('Failed to apply aggregate changes to the Blazar '
+                          'pool index, dropping it.')
+            index.drop()
+
+
+def watch_host_manager(index):
+    """Apply the aggregate changes received by the HostManager to an index.
+
+    NOTE: nova does not let external code subscribe to the aggregate
+    updates it receives, so the HostManager methods handling them are
+    wrapped once to also pass them to the watching indexes, until
+    unwatch_host_manager is called.
+    """
+    from nova import objects
+    from nova.scheduler import host_manager
+
+    _WATCHING_INDEXES.add(index)
+    if _WRAPPED_METHODS:
+        return
+    manager_cls = host_manager.HostManager
+
+    init_aggregates = manager_cls._init_aggregates
+    update_aggregates = manager_cls.update_aggregates
+    delete_aggregate = manager_cls.delete_aggregate
+
+    @functools.wraps(init_aggregates)
+    def _init_aggregates(self):
+        init_aggregates(self)
+        _notify_indexes('warm_up', list(self.aggs_by_id.values()))
+
+    @functools.wraps(update_aggregates)
+    def _update_aggregates(self, aggregates):
+        update_aggregates(self, aggregates)
+        if not isinstance(aggregates, (list, objects.AggregateList)):
+            aggregates = [aggregates]
+        _notify_indexes('update_aggregates', aggregates)
+
+    @functools.wraps(delete_aggregate)
+    def _delete_aggregate(self, aggregate):
+        delete_aggregate(self, aggregate)
+        _notify_indexes('delete_aggregate', aggregate)
+
+    _WRAPPED_METHODS.update(_init_aggregates=init_aggregates,
+                            update_aggregates=update_aggregates,
+                            delete_aggregate=delete_aggregate)
+    manager_cls._init_aggregates = _init_aggregates
+    manager_cls.update_aggregates = _update_aggregates
+    manager_cls.delete_aggregate = _delete_aggregate
+
+
+def unwatch_host_manager():
+    """Restore the HostManager methods and forget the watching indexes."""
+    from nova.scheduler import host_manager
+
+    _WATCHING_INDEXES.clear()
+    for name, method in _WRAPPED_METHODS.items():
+        setattr(host_manager.HostManager, name, method)
+    _WRAPPED_METHODS.clear()
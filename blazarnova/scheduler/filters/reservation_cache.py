@@ -0,0 +1,193 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Cache of the state of the Blazar host reservations.
+
+All the leases are listed from the Blazar API at a regular interval by a
+background thread, so that BlazarFilter can tell without any API call
+whether the reservations of a request can be used at all. The client
+authenticates with the options of the [blazar] group, the usual keystone
+session, auth and adapter ones.
+"""
+
+import collections
+import os
+import threading
+
+from keystoneauth1 import loading as ks_loading
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+LOG = logging.getLogger(__name__)
+
+GROUP = 'blazar'
+SERVICE_TYPE = 'reservation'
+
+ks_loading.register_session_conf_options(cfg.CONF, GROUP)
+ks_loading.register_auth_conf_options(cfg.CONF, GROUP)
+ks_loading.register_adapter_conf_options(cfg.CONF, GROUP)
+
+# Statuses of reservations which will never be usable again
+DEAD_STATUSES = frozenset(['deleted', 'error'])
+
+ReservationState = collections.namedtuple(
+    'ReservationState', ['status', 'start', 'end'])
+
+
+class BlazarClient(object):
+    """Client of the leases API of Blazar.
+
+    The keystoneauth session keeps a pool of connections to the API, which
+    are reused from one listing to the next.
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    @classmethod
+    def from_conf(cls, conf=cfg.CONF):
+        """Return a client configured with the [blazar] options."""
+        auth = ks_loading.load_auth_from_conf_options(conf, GROUP)
+        session = ks_loading.load_session_from_conf_options(
+            conf, GROUP, auth=auth)
+        adapter = ks_loading.load_adapter_from_conf_options(
+            conf, GROUP, session=session, auth=auth)
+        if not adapter.service_type:
+            adapter.service_type = SERVICE_TYPE
+        return cls(adapter)
+
+    def list_leases(self):
+        """Return all the leases, with their reservations."""
+        response = self.adapter.get('/leases', raise_exc=True)
+        return response.json()['leases']
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return timeutils.normalize_time(timeutils.parse_isotime(value))
+
+
+class ReservationCache(object):
+    """States of the host reservations, keyed by reservation ID.
+
+    The reservation ID is the name of the aggregate of the reserved hosts,
+    which requests give in their reservation hint.
+
+    The cache is only used while its last refresh is at most max_age
+    seconds old. Past that, it cannot tell anything and the filter checks
+    the hosts as if there were no cache.
+    """
+
+    def __init__(self, client, interval, max_age):
+        self.client = client
+        self.interval = interval
+        self.max_age = max_age
+        # Dict of ReservationState keyed by reservation ID, replaced as a
+        # whole on refresh
+        self._states = {}
+        self.refreshed_at = None
+        self._stopped = threading.Event()
+        self._thread = None
+        # Process the refresh thread runs in
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def refresh(self):
+        """List the leases and replace the cached reservation states."""
+        states = {}
+        for lease in self.client.list_leases():
+            start = _parse_date(lease.get('start_date'))
+            end = _parse_date(lease.get('end_date'))
+            for reservation in lease.get('reservations') or []:
+                if reservation.get('resource_type') != 'physical:host':
+                    continue
+                states[reservation['id']] = ReservationState(
+                    status=reservation.get('status'), start=start, end=end)
+        self._states = states
+        self.refreshed_at = timeutils.now()
+        LOG.debug('Cached the state of %d Blazar host reservations',
+                  len(states))
+
+    def start(self):
+        """Refresh the cache every interval seconds in a thread.
+
+        Nothing is done if the thread of this process is running. A thread
+        started before a fork does not run in the child process, which
+        starts its own.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._stopped,),
+                name='blazar-reservation-cache', daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def stop(self):
+        """Stop the refresh thread."""
+        with self._start_lock:
+            self._stopped.set()
+            if self._thread is not None and self._pid == os.getpid():
+                self._thread.join()
+            self._thread = None
+            self._pid = None
+
+    def _run(self, stopped):
+        while not stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                LOG.exception('Failed to list the Blazar leases, the cached '
+                              'reservation states are not refreshed.')
+            stopped.wait(self.interval)
+
+    def is_fresh(self):
+        """Whether the cache is recent enough to be used."""
+        return (self.refreshed_at is not None and
+                timeutils.now() - self.refreshed_at <= self.max_age)
+
+    def get(self, reservation_id):
+        """Return the cached state of a reservation, or None."""
+        return self._states.get(reservation_id)
+
+    def is_inactive(self, reservation_ids):
+        """Whether none of the reservations can be used now.
+
+        This is only True when the cache is fresh and knows all the
+        reservations, so that new reservations and stale caches are left
+        to the checks of the hosts.
+        """
+        if not reservation_ids or not self.is_fresh():
+            return False
+        states = self._states
+        now = timeutils.utcnow()
+        for reservation_id in reservation_ids:
+            state = states.get(reservation_id)
+            if state is None:
+                return False
+            if state.status in DEAD_STATUSES:
+                continue
+            # NOTE: The dates decide rather than the pending and active
+            # statuses, which may not be refreshed yet when a lease starts.
+            if state.start is not None and now < state.start:
+                continue
+            if state.end is not None and now >= state.end:
+                continue
+            return False
+        return True
@@ -0,0 +1,83 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Cache of BlazarFilter decisions shared by identical requests."""
+
+import collections
+import threading
+
+from oslo_utils import timeutils
+
+
+class ResultCache(object):
+    """LRU cache of host decisions keyed by request.
+
+    Each entry maps host names to whether they passed the filter for
+    requests with the same key. Entries expire after ttl seconds, and all
+    of them are dropped when the generation of the aggregates changes.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # OrderedDict of (expiry, dict of decisions keyed by host name)
+        # keyed by request key, least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.generation = generation
+
+    def get(self, key, generation, host_names):
+        """Return the cached decisions for all the hosts, or None."""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiry, decisions = entry
+                if expiry < timeutils.now():
+                    del self._entries[key]
+                elif all(name in decisions for name in host_names):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return decisions
+            self.misses += 1
+            return None
+
+    def put(self, key, generation, decisions):
+        """Remember host decisions for a request key."""
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1].update(decisions)
+                self._entries.move_to_end(key)
+            else:
+                self._entries[key] = (timeutils.now() + self.ttl,
+                                      dict(decisions))
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return the counters of the cache."""
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations}
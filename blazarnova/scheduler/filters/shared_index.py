@@ -0,0 +1,178 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Pool index shared by the nova-scheduler workers of a host.
+
+One worker, the publisher, writes the state of its PoolIndex to a file
+each time it changes. The other workers map the file read-only and adopt
+its state instead of building their own index. They leave the aggregate
+changes they receive to the publisher, which receives them as well, and
+only copy the per host arrays if they have to change them themselves.
+
+The publisher is the worker holding an exclusive lock on the file with a
+.lock suffix, which other workers try to take while it is free. The lock
+is only taken when the index is first synchronized, as nova creates the
+filters in the nova-scheduler parent process before forking the workers.
+A forked worker drops what it inherited from its parent and tries again.
+
+The file starts with a header holding a magic string and the sizes of the
+JSON metadata and of each per host array that follow it.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = b'BLZIDX02'
+HEADER = struct.Struct('<8sQQQQ')
+
+# Seconds between two attempts of a reader to become the publisher
+PUBLISHER_RETRY_INTERVAL = 10
+
+
+class SharedIndex(object):
+    """Publisher or reader of a pool index file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.publisher = False
+        self._lock_file = None
+        self._next_lock_attempt = 0
+        # Generation of the index snapshot last written to the file
+        self.published_generation = None
+        # Whether the index has the published state, not one of its own
+        self.adopted = False
+        # (device, inode) of the adopted file and its mapping
+        self._file_id = None
+        self._mmap = None
+        # Process the state above belongs to
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        if self._lock_file is not None:
+            # NOTE: The lock belongs to the open file shared with the
+            # parent, which does not schedule, so release it for the
+            # workers to elect one of them.
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+        self.publisher = False
+        self._next_lock_attempt = 0
+        self.published_generation = None
+        self.adopted = False
+        self._file_id = None
+        self._mmap = None
+
+    def try_publish(self):
+        """Become the publisher if no other worker is.
+
+        Raises OSError if the lock file cannot be opened.
+        """
+        self._check_fork()
+        if self.publisher:
+            return True
+        now = timeutils.now()
+        if now < self._next_lock_attempt:
+            return False
+        self._next_lock_attempt = now + PUBLISHER_RETRY_INTERVAL
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.publisher = True
+        self.published_generation = None
+        self.adopted = False
+        # What a previous publisher left may be outdated
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        LOG.info('Publishing the Blazar pool index to %s', self.path)
+        return True
+
+    def publish(self, index, snapshot):
+        """Write a snapshot of an index to the file."""
+        meta, buffers = index.export_state(snapshot)
+        meta = json.dumps(meta).encode('utf-8')
+        header = HEADER.pack(MAGIC, len(meta),
+                             *[len(buf) for buf in buffers])
+        # Replace the file at once so that readers never map it half written
+        tmp_path = '%s.%d.%d.tmp' % (self.path, os.getpid(),
+                                     threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(meta)
+            for buf in buffers:
+                f.write(buf)
+        os.replace(tmp_path, self.path)
+        self.published_generation = snapshot.generation
+
+    def refresh(self, index):
+        """Adopt the published state in an index if it changed.
+
+        Returns whether the index state was replaced.
+        """
+        self._check_fork()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id == self._file_id:
+            return False
+
+        with open(self.path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        magic, meta_len, *sizes = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            view.release()
+            mapping.close()
+            raise ValueError('%s is not a Blazar pool index' % self.path)
+        offset = HEADER.size
+        meta = json.loads(bytes(view[offset:offset + meta_len]))
+        offset += meta_len
+        buffers = []
+        for size in sizes:
+            buffers.append(view[offset:offset + size])
+            offset += size
+
+        if not index.adopt_state(meta, buffers):
+            # Published with other settings, this worker keeps its own
+            self.adopted = False
+            for buf in buffers:
+                buf.release()
+            view.release()
+            mapping.close()
+            return False
+        # NOTE: The previous mapping is left to the garbage collector, as
+        # a request may still use views of it.
+        self._mmap = mapping
+        self._file_id = file_id
+        self.adopted = True
+        return True
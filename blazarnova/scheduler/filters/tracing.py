@@ -0,0 +1,115 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Trace points of BlazarFilter.
+
+Spans are sent to osprofiler when the scheduling request is profiled, and
+to the collectors added with add_collector, which let tests inspect them
+without any tracing backend. Nothing is done when neither is active.
+"""
+
+import collections
+import contextlib
+import functools
+
+from oslo_utils import importutils
+from oslo_utils import timeutils
+
+profiler = importutils.try_import('osprofiler.profiler')
+
+Span = collections.namedtuple('Span', ['name', 'info', 'duration'])
+
+# Collectors the finished spans are added to
+_COLLECTORS = []
+
+
+class Collector(object):
+    """In-memory collector of finished spans."""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, span):
+        self.spans.append(span)
+
+    def find(self, name):
+        """Return the collected spans with a name."""
+        return [span for span in self.spans if span.name == name]
+
+
+def add_collector(collector):
+    _COLLECTORS.append(collector)
+
+
+def remove_collector(collector):
+    if collector in _COLLECTORS:
+        _COLLECTORS.remove(collector)
+
+
+def enabled():
+    """Whether spans are currently recorded anywhere."""
+    return bool(_COLLECTORS) or (profiler is not None and
+                                 profiler.get() is not None)
+
+
+@contextlib.contextmanager
+def span(name, **info):
+    """Trace a block of code.
+
+    The yielded dict holds the attributes of the span, the block can add
+    the ones only known at its end.
+    """
+    if not enabled():
+        yield info
+        return
+
+    traced = profiler is not None and profiler.get() is not None
+    if traced:
+        profiler.start(name, info=dict(info))
+    start = timeutils.now()
+    try:
+        yield info
+    finally:
+        duration = timeutils.now() - start
+        if traced:
+            profiler.stop(info=info)
+        for collector in list(_COLLECTORS):
+            collector.add(Span(name, info, duration))
+
+
+def traced(name, get_info=None):
+    """Decorate a function to trace its calls.
+
+    get_info is called with the arguments of the function and returns the
+    attributes of the span. It is only called if spans are recorded.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            info = get_info(*args, **kwargs) if get_info else {}
+            with span(name, **info) as info:
+                result = fn(*args, **kwargs)
+                info['result'] = _describe(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def _describe(result):
+    if isinstance(result, (bool, int, str)) or result is None:
+        return result
+    try:
+        return len(result)
+    except TypeError:
+        return repr(result)
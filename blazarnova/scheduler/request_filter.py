@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Request filters restricting the placement query of Blazar requests.
+
+Those run before placement is asked for allocation candidates so that hosts
+BlazarFilter would reject are not even fetched. BlazarFilter still checks
+whether the project can use the hosts it gets.
+"""
+
+from blazarnova.i18n import _
+from blazarnova.scheduler.filters import blazar_filter
+from blazarnova.scheduler.filters import pool_index
+
+from nova import exception
+from nova import objects
+from nova.scheduler import request_filter
+from oslo_config import cfg
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _get_destination(request_spec):
+    if ('requested_destination' not in request_spec or
+            request_spec.requested_destination is None):
+        request_spec.requested_destination = objects.Destination()
+    return request_spec.requested_destination
+
+
+def _get_blazar_pools(ctxt):
+    conf = cfg.CONF['blazar:physical:host']
+    return [agg for agg in objects.AggregateList.get_all(ctxt)
+            if pool_index.classify_aggregate(
+                agg, conf.blazar_az_prefix, conf.aggregate_freepool_name,
+                conf.preemptible_aggregate, conf.blazar_owner).is_managed]
+
+
+@request_filter.trace_request_filter
+def require_reservation_aggregate(ctxt, request_spec):
+    """Require hosts in the aggregates of the requested reservations.
+
+    The reservation hint names the aggregates of the reserved hosts, so
+    placement is only asked for candidates members of one of them.
+    """
+    if not cfg.CONF['blazar:physical:host'].placement_reservation_prefilter:
+        return False
+
+    request_class, requested_pools = blazar_filter.classify_request(
+        request_spec)
+    if request_class != blazar_filter.RESERVATION:
+        return False
+
+    aggregates = objects.AggregateList.get_all(ctxt)
+    agg_uuids = [agg.uuid for agg in aggregates
+                 if agg.name in requested_pools]
+    if not agg_uuids:
+        LOG.info('No aggregate found for reservations %(pools)s requested '
+                 'by project %(project)s',
+                 {'pools': ','.join(requested_pools),
+                  'project': request_spec.project_id})
+        raise exception.RequestFilterFailed(
+            reason=_('No hosts available for reservation'))
+
+    _get_destination(request_spec).require_aggregates(agg_uuids)
+    LOG.debug('require_reservation_aggregate request filter added '
+              'aggregates %s for reservations %r',
+              ','.join(agg_uuids), requested_pools)
+    return True
+
+
+@request_filter.trace_request_filter
+def exclude_blazar_pools(ctxt, request_spec):
+    """Forbid hosts in Blazar pools for requests without reservation.
+
+    BlazarFilter rejects the hosts of the freepool and of the reservation
+    pools for such requests, so placement is asked to ignore them.
+    """
+    if not cfg.CONF['blazar:physical:host'].placement_exclude_pools_prefilter:
+        return False
+
+    request_class = blazar_filter.classify_request(request_spec)[0]
+    if request_class != blazar_filter.PLAIN:
+        return False
+
+    agg_uuids = set(agg.uuid for agg in _get_blazar_pools(ctxt))
+    if agg_uuids:
+        _get_destination(request_spec).append_forbidden_aggregates(agg_uuids)
+        LOG.debug('exclude_blazar_pools request filter added forbidden '
+                  'aggregates %s', ','.join(sorted(agg_uuids)))
+    return True
+
+
+@request_filter.trace_request_filter
+def require_preemptible_aggregate(ctxt, request_spec):
+    """Require hosts only in the preemptible aggregate for preemptibles.
+
+    BlazarFilter only lets preemptible instances on hosts whose only Blazar
+    pool is the preemptible aggregate, so placement is asked for members
+    of that aggregate which are in none of the other pools.
+    """
+    conf = cfg.CONF['blazar:physical:host']
+    if not conf.placement_preemptible_prefilter:
+        return False
+
+    request_class = blazar_filter.classify_request(request_spec)[0]
+    if request_class != blazar_filter.PREEMPTIBLE:
+        return False
+
+    required = []
+    forbidden = set()
+    for agg in _get_blazar_pools(ctxt):
+        if agg.name == conf.preemptible_aggregate:
+            required.append(agg.uuid)
+        else:
+            forbidden.add(agg.uuid)
+    if not required:
+        LOG.info('No preemptible aggregate %(aggregate)s found for the '
+                 'request of project %(project)s',
+                 {'aggregate': conf.preemptible_aggregate,
+                  'project': request_spec.project_id})
+        raise exception.RequestFilterFailed(
+            reason=_('No hosts available for preemptible instances'))
+
+    destination = _get_destination(request_spec)
+    destination.require_aggregates(required)
+    if forbidden:
+        destination.append_forbidden_aggregates(forbidden)
+    LOG.debug('require_preemptible_aggregate request filter added '
+              'aggregates %(required)s and forbidden aggregates '
+              '%(forbidden)s',
+              {'required': ','.join(required),
+               'forbidden': ','.join(sorted(forbidden))})
+    return True
+
+
+BLAZAR_REQUEST_FILTERS = [
+    require_reservation_aggregate,
+    exclude_blazar_pools,
+    require_preemptible_aggregate,
+]
+
+
+def register():
+    """Add the Blazar request filters to the ones run by nova."""
+    for fn in BLAZAR_REQUEST_FILTERS:
+        if fn not in request_filter.ALL_REQUEST_FILTERS:
+            request_filter.ALL_REQUEST_FILTERS.append(fn)
+
+
+def unregister():
+    """Remove the Blazar request filters added by register."""
+    for fn in BLAZAR_REQUEST_FILTERS:
+        if fn in request_filter.ALL_REQUEST_FILTERS:
+            request_filter.ALL_REQUEST_FILTERS.remove(fn)
@@ -0,0 +1,313 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmark of BlazarFilter against synthetic clouds.
+
+A cloud of fake host states is generated with a number of reservation
+pools, a freepool, a preemptible aggregate and other aggregates shared by
+many hosts, then a mix of requests is run through the filter. The results
+are written as JSON so that they can be compared between versions::
+
+    python -m blazarnova.tests.benchmarks.filter_bench --hosts 10000 \\
+        --output results.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from blazarnova.cmd import filter_replay
+from blazarnova.scheduler.filters import blazar_filter
+from nova import objects
+from nova.tests.unit.scheduler import fakes
+from oslo_config import cfg
+
+REQUEST_CLASSES = (blazar_filter.PLAIN, blazar_filter.RESERVATION,
+                   blazar_filter.INSTANCE_RESERVATION,
+                   blazar_filter.PREEMPTIBLE)
+
+PREEMPTIBLE_AGGREGATE = 'preemptibles'
+
+
+class Cloud(object):
+    """Synthetic host states and aggregates."""
+
+    def __init__(self, host_states, aggregates, pools):
+        self.host_states = host_states
+        self.aggregates = aggregates
+        # Dict of owner project ID keyed by reservation pool name
+        self.pools = pools
+
+
+def build_cloud(hosts, pools, freepool_size, preemptible_size,
+                aggregates_per_host=2, hosts_per_aggregate=100, seed=0):
+    """Return a Cloud of fake host states.
+
+    The first freepool_size hosts are in the freepool and the next
+    preemptible_size hosts in the preemptible aggregate. The reservation
+    pools share the remaining hosts, but at most half of them so that
+    plain requests still have somewhere to go. Every host is also in
+    aggregates_per_host other aggregates of hosts_per_aggregate hosts.
+    """
+    conf = cfg.CONF['blazar:physical:host']
+    rand = random.Random(seed)
+    names = ['host%d' % i for i in range(hosts)]
+    members = {}
+    aggregates = []
+
+    def add_aggregate(name, hosts, metadata):
+        agg = objects.Aggregate(id=len(aggregates) + 1, name=name,
+                                hosts=list(hosts), metadata=metadata)
+        aggregates.append(agg)
+        for host in hosts:
+            members.setdefault(host, []).append(agg)
+
+    add_aggregate(conf.aggregate_freepool_name, names[:freepool_size],
+                  {'availability_zone': ''})
+    start = freepool_size
+    add_aggregate(PREEMPTIBLE_AGGREGATE,
+                  names[start:start + preemptible_size], {})
+    start += preemptible_size
+
+    pool_owners = {}
+    reserved = names[start:start + (hosts - start) // 2]
+    for i in range(pools):
+        name = 'r-pool%d' % i
+        owner = 'project%d' % i
+        pool_owners[name] = owner
+        add_aggregate(name, reserved[i::pools],
+                      {'availability_zone': conf.blazar_az_prefix + name,
+                       conf.blazar_owner: owner})
+
+    for i in range(aggregates_per_host * hosts // hosts_per_aggregate):
+        add_aggregate('agg%d' % i,
+                      rand.sample(names, min(hosts, hosts_per_aggregate)),
+                      {'availability_zone': 'az%d' % (i % 3)})
+
+    host_states = []
+    for i, name in enumerate(names):
+        host_state = fakes.FakeHostState(name, 'node%d' % i, {})
+        host_state.aggregates = members.get(name, [])
+        host_states.append(host_state)
+    return Cloud(host_states, aggregates, pool_owners)
+
+
+def build_request(cloud, request_class, rand):
+    """Return a RequestSpec of the given class for a cloud."""
+    hints = {}
+    extra_specs = {}
+    project_id = 'project-plain'
+    if request_class == blazar_filter.RESERVATION:
+        pool = rand.choice(sorted(cloud.pools))
+        project_id = cloud.pools[pool]
+        hints['reservation'] = [pool]
+    elif request_class == blazar_filter.INSTANCE_RESERVATION:
+        extra_specs[blazar_filter.FLAVOR_EXTRA_SPEC] = 'reservation-id'
+    elif request_class == blazar_filter.PREEMPTIBLE:
+        extra_specs[blazar_filter.FLAVOR_PREEMPTIBLE] = 'true'
+    return objects.RequestSpec(
+        project_id=project_id,
+        scheduler_hints=hints,
+        flavor=objects.Flavor(flavorid='flavor-id', extra_specs=extra_specs))
+
+
+def index_memory(cloud):
+    """Return the memory used by the pool index of a cloud, per host."""
+    f = blazar_filter.BlazarFilter()
+    tracemalloc.start()
+    try:
+        f.pool_index.load_aggregates(cloud.aggregates)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size / len(cloud.host_states)
+
+
+def signatures(cloud, requests=5, seed=0):
+    """Return what memoising decisions by pool signature saves in a cloud.
+
+    That is the number of distinct pool signatures of the hosts, and for
+    each request class the speed-up of checking every host once per
+    signature over checking each of them.
+    """
+    rand = random.Random(seed)
+    f = blazar_filter.BlazarFilter()
+    result = {
+        'signatures': len(set(f.pool_signature(host_state)
+                              for host_state in cloud.host_states)),
+        'speedup': {},
+    }
+    for request_class in (blazar_filter.PLAIN, blazar_filter.RESERVATION,
+                          blazar_filter.PREEMPTIBLE):
+        if request_class == blazar_filter.RESERVATION and not cloud.pools:
+            continue
+        each = once = 0
+        for _i in range(requests):
+            context = f.build_context(
+                build_request(cloud, request_class, rand))
+            start = time.perf_counter()
+            for host_state in cloud.host_states:
+                f._reject_reason(host_state, context)
+            each += time.perf_counter() - start
+            start = time.perf_counter()
+            for host_state in cloud.host_states:
+                f.host_passes_context(host_state, context)
+            once += time.perf_counter() - start
+        result['speedup'][request_class] = each / once if once else 0
+    return result
+
+
+def run(cloud, mix, requests, host_passes_requests=0, seed=0,
+        load_index=True):
+    """Run a mix of requests against a cloud and return the results.
+
+    mix is a dict of weights keyed by request class. Each request is run
+    through filter_all, and the first host_passes_requests of each class
+    are also run host by host through host_passes. Unless load_index is
+    False, the pool index is warmed up with all the aggregates first, as
+    when the HostManager starts.
+    """
+    rand = random.Random(seed)
+    f = blazar_filter.BlazarFilter()
+    if load_index:
+        f.pool_index.warm_up(cloud.aggregates)
+    classes = [request_class for request_class in REQUEST_CLASSES
+               if mix.get(request_class) and (
+                   request_class != blazar_filter.RESERVATION or cloud.pools)]
+    weights = [mix[request_class] for request_class in classes]
+    hosts = len(cloud.host_states)
+
+    filter_all = dict((request_class, []) for request_class in classes)
+    host_passes = dict((request_class, []) for request_class in classes)
+    survivors = dict((request_class, 0) for request_class in classes)
+    for request_class in rand.choices(classes, weights, k=requests):
+        spec_obj = build_request(cloud, request_class, rand)
+        start = time.perf_counter()
+        passing = f.filter_all(cloud.host_states, spec_obj)
+        filter_all[request_class].append(time.perf_counter() - start)
+        survivors[request_class] += len(passing)
+
+        if len(host_passes[request_class]) < host_passes_requests:
+            start = time.perf_counter()
+            for host_state in cloud.host_states:
+                f.host_passes(host_state, spec_obj)
+            host_passes[request_class].append(time.perf_counter() - start)
+
+    results = {}
+    for request_class in classes:
+        durations = filter_all[request_class]
+        result = {
+            'requests': len(durations),
+            'mean_survivors': (survivors[request_class] / len(durations)
+                               if durations else 0),
+            'filter_all_ms': filter_replay.percentiles(durations),
+        }
+        if durations:
+            result['filter_all_per_host_us'] = (
+                sum(durations) / len(durations) / hosts * 1e6)
+        if host_passes[request_class]:
+            durations = host_passes[request_class]
+            result['host_passes_per_host_us'] = (
+                sum(durations) / len(durations) / hosts * 1e6)
+        results[request_class] = result
+    return results
+
+
+def parse_mix(value):
+    """Parse a request mix like 'plain=70,reservation=30'."""
+    mix = {}
+    for item in value.split(','):
+        request_class, _sep, weight = item.partition('=')
+        if request_class not in REQUEST_CLASSES:
+            raise argparse.ArgumentTypeError(
+                'Unknown request class %s' % request_class)
+        mix[request_class] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hosts', type=int, nargs='+',
+                        default=[1000, 10000, 50000],
+                        help='Sizes of the clouds to benchmark.')
+    parser.add_argument('--pools', type=int, default=50,
+                        help='Number of reservation pools.')
+    parser.add_argument('--freepool-ratio', type=float, default=0.2,
+                        help='Ratio of the hosts in the freepool.')
+    parser.add_argument('--preemptible-ratio', type=float, default=0.1,
+                        help='Ratio of the hosts in the preemptible '
+                             'aggregate.')
+    parser.add_argument('--aggregates-per-host', type=int, default=2,
+                        help='Number of other aggregates of each host.')
+    parser.add_argument('--mix', type=parse_mix,
+                        default='plain=60,reservation=25,'
+                                'instance_reservation=5,preemptible=10',
+                        help='Weights of the request classes.')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Number of requests per cloud.')
+    parser.add_argument('--host-passes-requests', type=int, default=5,
+                        help='Number of requests of each class also run '
+                             'host by host through host_passes.')
+    parser.add_argument('--result-cache-size', type=int, default=0,
+                        help='Size of the result cache of the filter.')
+    parser.add_argument('--no-load-index', dest='load_index',
+                        action='store_false',
+                        help='Let the filter learn the aggregates from the '
+                             'hosts instead of loading them all first.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='File to write the JSON results '
+                                         'to, instead of stdout.')
+    args = parser.parse_args(argv)
+
+    objects.register_all()
+    cfg.CONF([], project='nova', default_config_files=[])
+    for name, value in (('allow_preemptibles', True),
+                        ('preemptible_aggregate', PREEMPTIBLE_AGGREGATE),
+                        ('result_cache_size', args.result_cache_size)):
+        cfg.CONF.set_override(name, value, group='blazar:physical:host')
+
+    clouds = []
+    for hosts in args.hosts:
+        cloud = build_cloud(
+            hosts, args.pools, int(hosts * args.freepool_ratio),
+            int(hosts * args.preemptible_ratio),
+            aggregates_per_host=args.aggregates_per_host, seed=args.seed)
+        results = run(cloud, args.mix, args.requests,
+                      host_passes_requests=args.host_passes_requests,
+                      seed=args.seed, load_index=args.load_index)
+        clouds.append({'hosts': hosts, 'aggregates': len(cloud.aggregates),
+                       'index_bytes_per_host': index_memory(cloud),
+                       'pool_signatures': signatures(cloud, seed=args.seed),
+                       'results': results})
+        for request_class, result in sorted(results.items()):
+            sys.stderr.write('%6d hosts %-20s p50 %8.2f ms  p99 %8.2f ms\n'
+                             % (hosts, request_class,
+                                result['filter_all_ms'].get('p50', 0),
+                                result['filter_all_ms'].get('p99', 0)))
+
+    output = {
+        'parameters': dict(vars(args), mix=args.mix),
+        'clouds': clouds,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
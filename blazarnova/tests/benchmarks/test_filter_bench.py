@@ -0,0 +1,71 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from blazarnova.scheduler.filters import blazar_filter
+from blazarnova.tests.benchmarks import filter_bench
+from blazarnova.tests import fixtures as blazar_fixtures
+from nova import test
+
+
+class FilterBenchTestCase(test.NoDBTestCase):
+    """Keep the benchmark of BlazarFilter working on a tiny cloud."""
+
+    def setUp(self):
+        super(FilterBenchTestCase, self).setUp()
+        self.useFixture(blazar_fixtures.NovaHooks())
+        self.flags(allow_preemptibles=True,
+                   preemptible_aggregate=filter_bench.PREEMPTIBLE_AGGREGATE,
+                   group='blazar:physical:host')
+
+    def test_build_cloud(self):
+        cloud = filter_bench.build_cloud(20, 2, 4, 2, hosts_per_aggregate=10)
+
+        self.assertEqual(20, len(cloud.host_states))
+        # freepool, preemptibles, 2 pools and 4 other aggregates
+        self.assertEqual(8, len(cloud.aggregates))
+        self.assertEqual({'r-pool0': 'project0', 'r-pool1': 'project1'},
+                         cloud.pools)
+
+    def test_run(self):
+        cloud = filter_bench.build_cloud(20, 2, 4, 2, hosts_per_aggregate=10)
+
+        for request_class, survivors, load_index in (
+                (blazar_filter.PLAIN, 7, True),
+                (blazar_filter.PLAIN, 7, False),
+                (blazar_filter.PREEMPTIBLE, 2, True),
+                (blazar_filter.PREEMPTIBLE, 2, False),
+                (blazar_filter.INSTANCE_RESERVATION, 20, True)):
+            results = filter_bench.run(cloud, {request_class: 1}, 2,
+                                       host_passes_requests=1,
+                                       load_index=load_index)
+
+            result = results[request_class]
+            self.assertEqual(2, result['requests'])
+            self.assertEqual(survivors, result['mean_survivors'])
+            self.assertIn('p99', result['filter_all_ms'])
+            self.assertIn('host_passes_per_host_us', result)
+
+    def test_signatures(self):
+        cloud = filter_bench.build_cloud(20, 2, 4, 2, hosts_per_aggregate=10)
+
+        result = filter_bench.signatures(cloud, requests=1)
+
+        # Unpooled, freepool, preemptibles and each pool
+        self.assertEqual(5, result['signatures'])
+        self.assertEqual(
+            {blazar_filter.PLAIN, blazar_filter.RESERVATION,
+             blazar_filter.PREEMPTIBLE}, set(result['speedup']))
+
+    def test_index_memory(self):
+        cloud = filter_bench.build_cloud(20, 2, 4, 2, hosts_per_aggregate=10)
+
+        self.assertGreater(filter_bench.index_memory(cloud), 0)
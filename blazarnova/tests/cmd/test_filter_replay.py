@@ -0,0 +1,103 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import json
+import os
+from unittest import mock
+
+import fixtures
+
+from blazarnova.cmd import filter_replay
+from blazarnova.tests import fixtures as blazar_fixtures
+from nova import test
+
+SNAPSHOT = {
+    'hosts': ['host1', 'host2', 'host3', 'host4'],
+    'aggregates': [
+        {'id': 1, 'name': 'freepool', 'hosts': ['host1'], 'metadata': {}},
+        {'id': 2, 'name': 'r-fakeres', 'hosts': ['host2', 'host3'],
+         'metadata': {'availability_zone': 'blazar_r-fakeres',
+                      'blazar:owner': 'fakepj'}},
+    ],
+}
+
+REQUESTS = [
+    {'id': 'plain', 'project_id': 'fakepj'},
+    {'id': 'reservation', 'project_id': 'fakepj',
+     'scheduler_hints': {'reservation': 'r-fakeres'}},
+    {'id': 'unauthorized', 'project_id': 'otherpj',
+     'scheduler_hints': {'reservation': ['r-fakeres']}},
+]
+
+
+class FilterReplayTestCase(test.NoDBTestCase):
+    """Tests for the replay of recorded requests."""
+
+    def setUp(self):
+        super(FilterReplayTestCase, self).setUp()
+        self.useFixture(blazar_fixtures.NovaHooks())
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.snapshot = os.path.join(self.tmpdir, 'snapshot.json')
+        with open(self.snapshot, 'w') as f:
+            json.dump(SNAPSHOT, f)
+        self.requests = os.path.join(self.tmpdir, 'requests.jsonl')
+        with open(self.requests, 'w') as f:
+            for request in REQUESTS:
+                f.write(json.dumps(request) + '\n')
+
+    def test_load_snapshot(self):
+        host_states, aggregates = filter_replay.load_snapshot(self.snapshot)
+
+        self.assertEqual(['host1', 'host2', 'host3', 'host4'],
+                         [host_state.host for host_state in host_states])
+        self.assertEqual(['freepool', 'r-fakeres'],
+                         [agg.name for agg in aggregates])
+        self.assertEqual(['freepool'],
+                         [agg.name for agg in host_states[0].aggregates])
+        self.assertEqual([], host_states[3].aggregates)
+
+    def test_replay(self):
+        host_states, aggregates = filter_replay.load_snapshot(self.snapshot)
+        report = filter_replay.replay(
+            host_states, aggregates,
+            filter_replay.load_requests(self.requests),
+            repeat=2, record_hosts=True)
+
+        # The requests went through a warmed up index
+        self.assertTrue(report['index_complete'])
+        self.assertEqual(2, report['aggregates'])
+        self.assertEqual(6, report['requests'])
+        self.assertIn('p99', report['latency_ms'])
+        self.assertEqual(
+            [('plain', 'plain', ['host4']),
+             ('reservation', 'reservation', ['host2', 'host3']),
+             ('unauthorized', 'reservation', [])],
+            [(outcome['id'], outcome['request_class'], outcome['hosts'])
+             for outcome in report['outcomes']])
+
+    @mock.patch.object(filter_replay, 'cfg')
+    def test_main(self, mock_cfg):
+        output = os.path.join(self.tmpdir, 'report.json')
+        self.useFixture(fixtures.MonkeyPatch('sys.stderr', io.StringIO()))
+
+        filter_replay.main([self.snapshot, self.requests,
+                            '--config-file', 'nova.conf',
+                            '--output', output])
+
+        mock_cfg.CONF.assert_called_once_with(
+            [], project='nova', default_config_files=['nova.conf'])
+
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(3, report['requests'])
+        self.assertNotIn('hosts', report['outcomes'][0])
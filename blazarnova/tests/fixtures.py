@@ -0,0 +1,31 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Fixtures for Blazar Nova tests."""
+
+import fixtures
+
+from blazarnova.scheduler.filters import pool_index
+from blazarnova.scheduler import request_filter
+
+
+class NovaHooks(fixtures.Fixture):
+    """Undo the hooks a BlazarFilter installs in nova when loaded.
+
+    The HostManager methods wrapped by watch_host_manager are restored and
+    the Blazar request filters are removed from the nova ones, so that they
+    do not leak into the next tests.
+    """
+
+    def _setUp(self):
+        self.addCleanup(pool_index.unwatch_host_manager)
+        self.addCleanup(request_filter.unregister)
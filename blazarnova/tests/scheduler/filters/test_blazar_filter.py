@@ -12,7 +12,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import itertools
+import logging
+from unittest import mock
+
 from blazarnova.scheduler.filters import blazar_filter
+from blazarnova.scheduler.filters import reservation_cache
+from blazarnova.scheduler.filters import tracing
+from blazarnova.tests import fixtures as blazar_fixtures
 from nova import objects
 from nova import test
 from nova.tests.unit.scheduler import fakes
@@ -30,6 +37,7 @@ class BlazarFilterTestCase(test.TestCase):
     """
     def setUp(self):
         super(BlazarFilterTestCase, self).setUp()
+        self.useFixture(blazar_fixtures.NovaHooks())
 
         # Let's have at hand a brand new blazar filter
         self.f = blazar_filter.BlazarFilter()
@@ -292,6 +300,7 @@ class BlazarFilterTestCase(test.TestCase):
                               group='blazar:physical:host')
         self.addCleanup(cfg.CONF.clear_override, 'allow_preemptibles',
                         group='blazar:physical:host')
+        self.f.refresh_settings()
 
         # Given the host is in the free pool
         self.host.aggregates = [
@@ -319,6 +328,7 @@ class BlazarFilterTestCase(test.TestCase):
                               group='blazar:physical:host')
         self.addCleanup(cfg.CONF.clear_override, 'preemptible_aggregate',
                         group='blazar:physical:host')
+        self.f.refresh_settings()
 
         # Given the host is in the preemptibles aggregate
         self.host.aggregates = [
@@ -346,6 +356,7 @@ class BlazarFilterTestCase(test.TestCase):
                               group='blazar:physical:host')
         self.addCleanup(cfg.CONF.clear_override, 'preemptible_aggregate',
                         group='blazar:physical:host')
+        self.f.refresh_settings()
 
         # Given the host is in the free pool
         self.host.aggregates = [
@@ -362,3 +373,535 @@ class BlazarFilterTestCase(test.TestCase):
 
         # Then the host shall NOT pass
         self.assertFalse(self.host.passes)
+
+    def _hosts_for_filter_all(self):
+        unpooled = fakes.FakeHostState('host1', 'node1', {})
+        unpooled.aggregates = []
+        freepool = fakes.FakeHostState('host2', 'node2', {})
+        freepool.aggregates = [
+            objects.Aggregate(
+                name=cfg.CONF['blazar:physical:host'].aggregate_freepool_name,
+                metadata={'availability_zone': ''})]
+        reserved = fakes.FakeHostState('host3', 'node3', {})
+        reserved.aggregates = [
+            objects.Aggregate(
+                name='r-fakeres',
+                metadata={'availability_zone': (cfg
+                                                .CONF['blazar:physical:host']
+                                                .blazar_az_prefix),
+                          self.spec_obj.project_id: True})]
+        return [unpooled, freepool, reserved]
+
+    def test_filter_all_no_pool_requested(self):
+        hosts = self._hosts_for_filter_all()
+
+        passing = list(self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual([hosts[0]], passing)
+
+    def test_filter_all_pool_requested(self):
+        hosts = self._hosts_for_filter_all()
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        passing = list(self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual([hosts[2]], passing)
+
+    def test_filter_all_instance_reservation_requested(self):
+        hosts = self._hosts_for_filter_all()
+        self.spec_obj.flavor.extra_specs = {
+            FLAVOR_EXTRA_SPEC: 'instance-reservation-id1'}
+
+        passing = list(self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual(hosts, passing)
+
+    def test_filter_all_preemptibles(self):
+        cfg.CONF.set_override('allow_preemptibles', True,
+                              group='blazar:physical:host')
+        self.addCleanup(cfg.CONF.clear_override, 'allow_preemptibles',
+                        group='blazar:physical:host')
+        self.f.refresh_settings()
+        hosts = self._hosts_for_filter_all()
+        self.spec_obj.flavor.extra_specs = {'blazar:preemptible': 'true'}
+
+        passing = list(self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual([hosts[1]], passing)
+
+    def test_build_context(self):
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        context = self.f.build_context(self.spec_obj)
+
+        self.assertEqual(blazar_filter.RESERVATION, context.request_class)
+        self.assertEqual(frozenset(['r-fakeres']), context.requested_pools)
+        self.assertEqual('fakepj', context.project_id)
+
+    def test_filter_all_pool_requested_uses_index(self):
+        prefix = cfg.CONF['blazar:physical:host'].blazar_az_prefix
+        reserved = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1', 'host2'],
+            metadata={'availability_zone': prefix,
+                      self.spec_obj.project_id: 'blazar:tenant'})
+        hosts = []
+        for i in range(1, 11):
+            host = fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+            host.aggregates = [reserved] if i <= 2 else []
+            hosts.append(host)
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        # The first request learns the pool membership
+        self.assertEqual(hosts[:2],
+                         self.f.filter_all(hosts, self.spec_obj))
+
+        with mock.patch.object(self.f, 'host_passes_context',
+                               wraps=self.f.host_passes_context) as m:
+            self.assertEqual(hosts[:2],
+                             self.f.filter_all(hosts, self.spec_obj))
+        self.assertEqual(2, m.call_count)
+
+    def test_filter_all_memoised_by_pool_signature(self):
+        hosts = self._hosts_for_filter_all() + self._hosts_for_filter_all()
+
+        with mock.patch.object(self.f, '_reject_reason',
+                               wraps=self.f._reject_reason) as m:
+            self.assertEqual([hosts[0], hosts[3]],
+                             self.f.filter_all(hosts, self.spec_obj))
+        # Once for each of unpooled, freepool and reservation pool hosts
+        self.assertEqual(3, m.call_count)
+
+    def test_pool_signature(self):
+        hosts = self._hosts_for_filter_all()
+        hosts[0].aggregates = [objects.Aggregate(name='other', metadata={})]
+
+        self.assertEqual(
+            [(), ('freepool',), ('r-fakeres',)],
+            [self.f.pool_signature(host) for host in hosts])
+
+    def test_filter_all_pool_requested_index_stale(self):
+        prefix = cfg.CONF['blazar:physical:host'].blazar_az_prefix
+        metadata = {'availability_zone': prefix,
+                    self.spec_obj.project_id: 'blazar:tenant'}
+        reserved = objects.Aggregate(id=1, name='r-fakeres', hosts=['host1'],
+                                     metadata=metadata)
+        hosts = [fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+                 for i in (1, 2)]
+        hosts[0].aggregates = [reserved]
+        hosts[1].aggregates = []
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        self.assertEqual(hosts[:1], self.f.filter_all(hosts, self.spec_obj))
+
+        # host2 is then added to the pool
+        updated = objects.Aggregate(id=1, name='r-fakeres',
+                                    hosts=['host1', 'host2'],
+                                    metadata=metadata)
+        hosts[0].aggregates = [updated]
+        hosts[1].aggregates = [updated]
+
+        self.assertEqual(hosts, self.f.filter_all(hosts, self.spec_obj))
+
+    def _hosts_in_pool(self, metadata, count=10):
+        metadata = dict(metadata, availability_zone=(
+            cfg.CONF['blazar:physical:host'].blazar_az_prefix))
+        reserved = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host%d' % i
+                                           for i in range(count)],
+            metadata=metadata)
+        hosts = []
+        for i in range(count):
+            host = fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+            host.aggregates = [reserved]
+            hosts.append(host)
+        return hosts
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_pool_requested_unauthorized(self, mock_log):
+        hosts = self._hosts_in_pool({'blazar:owner': 'another_project_id'})
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        self.assertEqual(1, mock_log.info.call_count)
+
+        # Once the pool is known, hosts are not even checked
+        mock_log.reset_mock()
+        with mock.patch.object(self.f, 'host_passes_context') as m:
+            self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        m.assert_not_called()
+        mock_log.info.assert_called_once_with(
+            mock.ANY, {'tenant_id': 'fakepj', 'pool_ids': 'r-fakeres',
+                       'reason': blazar_filter.REJECT_UNAUTHORIZED})
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_pool_requested_unknown(self, mock_log):
+        hosts = self._hosts_in_pool({'fakepj': 'blazar:tenant'})
+        self.spec_obj.scheduler_hints = {'reservation': ['r-unknown']}
+
+        self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        mock_log.info.assert_called_once_with(
+            mock.ANY, {'tenant_id': 'fakepj', 'pool_ids': 'r-unknown',
+                       'reason': blazar_filter.REJECT_UNKNOWN_POOL})
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_reservation_inactive(self, mock_log):
+        hosts = self._hosts_for_filter_all()
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        self.f.reservation_cache = mock.Mock()
+        self.f.reservation_cache.is_inactive.return_value = True
+
+        with mock.patch.object(self.f, 'host_passes_context') as m:
+            self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        m.assert_not_called()
+        self.f.reservation_cache.start.assert_called_once_with()
+        self.f.reservation_cache.is_inactive.assert_called_once_with(
+            frozenset(['r-fakeres']))
+        mock_log.info.assert_called_once_with(
+            mock.ANY, {'tenant_id': 'fakepj', 'pool_ids': 'r-fakeres',
+                       'reason': blazar_filter.REJECT_INACTIVE})
+
+        # Reservations the cache cannot tell about are checked host by host
+        self.f.reservation_cache.is_inactive.return_value = False
+        self.assertEqual([hosts[2]], self.f.filter_all(hosts, self.spec_obj))
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_reservation_inactive_not_shadowed(self, mock_log):
+        self.flags(shadow_sample_rate=1, result_cache_size=10,
+                   metrics_enabled=True, group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        self.f.reservation_cache = mock.Mock()
+        self.f.reservation_cache.is_inactive.return_value = True
+        hosts = self._hosts_for_filter_all()
+        for i, host in enumerate(hosts):
+            for agg in host.aggregates:
+                agg.id = i
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+
+        # The reference, which checks the hosts, is not compared with
+        mock_log.warning.assert_not_called()
+        self.assertNotIn('blazar_filter_shadow', self.f.metrics.render())
+        # And the rejection is not cached, as the reservation may start
+        self.f.reservation_cache.is_inactive.return_value = False
+        self.assertEqual([hosts[2]], self.f.filter_all(hosts, self.spec_obj))
+
+    @mock.patch.object(reservation_cache, 'BlazarClient')
+    @mock.patch.object(reservation_cache.ReservationCache, 'start')
+    def test_reservation_cache_enabled(self, mock_start, mock_client):
+        self.flags(reservation_cache_interval=30,
+                   reservation_cache_max_age=120,
+                   group='blazar:physical:host')
+
+        self.f = blazar_filter.BlazarFilter()
+
+        cache = self.f.reservation_cache
+        self.assertEqual(mock_client.from_conf.return_value, cache.client)
+        self.assertEqual(30, cache.interval)
+        self.assertEqual(120, cache.max_age)
+        # The refresh thread is started by the workers, not on init
+        mock_start.assert_not_called()
+
+        self.f.filter_all(self._hosts_for_filter_all(), self.spec_obj)
+        mock_start.assert_called_once_with()
+
+    def test_filter_all_pool_requested_authorization_granted(self):
+        hosts = self._hosts_in_pool({'blazar:owner': 'another_project_id'})
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+
+        # The project is then granted access to the pool
+        granted = self._hosts_in_pool({'blazar:owner': 'another_project_id',
+                                       'fakepj': 'blazar:tenant'})
+
+        self.assertEqual(granted, self.f.filter_all(granted, self.spec_obj))
+
+    def test_filter_all_result_cache(self):
+        self.flags(result_cache_size=10, group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        hosts = self._hosts_for_filter_all()
+        for i, host in enumerate(hosts):
+            for agg in host.aggregates:
+                agg.id = i
+
+        self.assertEqual([hosts[0]], self.f.filter_all(hosts, self.spec_obj))
+        with mock.patch.object(self.f, 'host_passes_context') as m:
+            self.assertEqual([hosts[0]],
+                             self.f.filter_all(hosts, self.spec_obj))
+        m.assert_not_called()
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1,
+                          'invalidations': 0},
+                         self.f.result_cache.stats())
+
+        # Other requests use other entries
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        self.assertEqual([hosts[2]], self.f.filter_all(hosts, self.spec_obj))
+        self.assertEqual(2, self.f.result_cache.stats()['size'])
+
+    def test_settings_refreshed_on_mutate(self):
+        self.flags(allow_preemptibles=True, group='blazar:physical:host')
+        self.assertFalse(self.f.settings.allow_preemptibles)
+        generation = self.f.pool_index.generation
+
+        blazar_filter._refresh_settings(
+            cfg.CONF,
+            {('blazar:physical:host', 'allow_preemptibles'): (False, True)})
+
+        self.assertTrue(self.f.settings.allow_preemptibles)
+        # The classifications do not depend on this option
+        self.assertEqual(generation, self.f.pool_index.generation)
+
+        self.flags(aggregate_freepool_name='otherpool',
+                   group='blazar:physical:host')
+        blazar_filter._refresh_settings(
+            cfg.CONF,
+            {('blazar:physical:host', 'aggregate_freepool_name'): (
+                'freepool', 'otherpool')})
+
+        self.assertEqual('otherpool', self.f.settings.aggregate_freepool_name)
+        self.assertGreater(self.f.pool_index.generation, generation)
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_decision_summary(self, mock_log):
+        mock_log.isEnabledFor.return_value = True
+        hosts = self._hosts_for_filter_all()
+
+        self.assertEqual([hosts[0]], self.f.filter_all(hosts, self.spec_obj))
+
+        mock_log.info.assert_not_called()
+        mock_log.log.assert_called_once_with(
+            logging.DEBUG, mock.ANY,
+            {'request_class': blazar_filter.PLAIN, 'tenant_id': 'fakepj',
+             'passed': 1, 'hosts': 3,
+             'rejections': 'in_blazar_pool: 2 (host2,host3)'})
+        # Each rejected host is also logged
+        self.assertEqual(2, mock_log.debug.call_count)
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_decision_summary_not_sampled(self, mock_log):
+        self.flags(decision_log_sample_rate=0, group='blazar:physical:host')
+        self.f.refresh_settings()
+        mock_log.isEnabledFor.return_value = True
+        hosts = self._hosts_for_filter_all()[1:]
+
+        self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+
+        mock_log.log.assert_called_once_with(
+            logging.INFO, mock.ANY,
+            {'request_class': blazar_filter.PLAIN, 'tenant_id': 'fakepj',
+             'passed': 0, 'hosts': 2,
+             'rejections': 'in_blazar_pool: 2 (host2,host3)'})
+        mock_log.debug.assert_not_called()
+
+    def test_filter_all_metrics(self):
+        self.flags(metrics_enabled=True, group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        hosts = self._hosts_for_filter_all()
+
+        self.f.filter_all(hosts, self.spec_obj)
+
+        text = self.f.metrics.render()
+        self.assertIn(
+            'blazar_filter_requests_total{request_class="plain"} 1\n', text)
+        self.assertIn('blazar_filter_host_rejections_total'
+                      '{reason="in_blazar_pool"} 2\n', text)
+        self.assertIn('blazar_filter_hosts_out_sum{request_class="plain"} 1'
+                      '\n', text)
+
+    def test_filter_all_metrics_disabled(self):
+        self.assertIsNone(self.f.metrics)
+
+    @mock.patch.object(blazar_filter.shared_index, 'SharedIndex')
+    def test_filter_all_shared_index(self, mock_shared):
+        self.flags(shared_index_path='/dev/shm/blazar-pool-index',
+                   group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        mock_shared.assert_called_once_with('/dev/shm/blazar-pool-index')
+        shared = mock_shared.return_value
+        shared.refresh.return_value = False
+        shared.publisher = False
+        shared.try_publish.return_value = False
+        hosts = self._hosts_for_filter_all()
+
+        self.assertEqual(1, len(self.f.filter_all(hosts, self.spec_obj)))
+        shared.refresh.assert_called_with(self.f.pool_index)
+
+    @mock.patch.object(blazar_filter.time, 'sleep')
+    def test_filter_all_chunks(self, mock_sleep):
+        self.flags(chunk_size=2, group='blazar:physical:host')
+        self.f.refresh_settings()
+        hosts = self._hosts_for_filter_all() * 2
+
+        self.assertEqual([hosts[0], hosts[3]],
+                         self.f.filter_all(hosts, self.spec_obj))
+        # Between the 3 chunks
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    @mock.patch.object(blazar_filter.time, 'sleep')
+    def test_filter_all_time_budget(self, mock_sleep, mock_log):
+        self.flags(chunk_size=1, time_budget=1, metrics_enabled=True,
+                   group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        hosts = self._hosts_for_filter_all()
+
+        # The time read at the start, to set the deadline and before
+        # each chunk, goes forward by 0.6s each time
+        with mock.patch.object(blazar_filter.timeutils, 'now',
+                               side_effect=itertools.count(0, 0.6)):
+            self.assertEqual([hosts[0]],
+                             self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual(1, mock_log.warning.call_count)
+        self.assertEqual({'request_class': blazar_filter.PLAIN,
+                          'tenant_id': 'fakepj', 'budget': 1,
+                          'passed': 1, 'hosts': 3},
+                         mock_log.warning.call_args[0][1])
+        text = self.f.metrics.render()
+        self.assertIn('blazar_filter_time_budget_exceeded_total'
+                      '{request_class="plain"} 1\n', text)
+        self.assertIn('blazar_filter_host_rejections_total'
+                      '{reason="time_budget_exceeded"} 2\n', text)
+
+    def test_filter_all_traced(self):
+        collector = tracing.Collector()
+        tracing.add_collector(collector)
+        self.addCleanup(tracing.remove_collector, collector)
+        hosts = self._hosts_for_filter_all()
+
+        self.f.filter_all(hosts, self.spec_obj)
+
+        span = collector.find('BlazarFilter.filter_all')[0]
+        self.assertEqual({'candidates': 3, 'survivors': 1,
+                          'request_class': blazar_filter.PLAIN}, span.info)
+        self.assertEqual(
+            3, len(collector.find('BlazarFilter.fetch_blazar_pools')))
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_shadow(self, mock_log):
+        self.flags(shadow_sample_rate=1, metrics_enabled=True,
+                   group='blazar:physical:host')
+        self.f = blazar_filter.BlazarFilter()
+        hosts = self._hosts_for_filter_all()
+
+        for hints in ({}, {'reservation': ['r-fakeres']}):
+            self.spec_obj.scheduler_hints = hints
+            self.f.filter_all(hosts, self.spec_obj)
+
+        mock_log.warning.assert_not_called()
+        text = self.f.metrics.render()
+        self.assertIn('blazar_filter_shadow_requests_total'
+                      '{request_class="reservation"} 1\n', text)
+        self.assertNotIn('blazar_filter_shadow_mismatches_total', text)
+
+        # Decisions of the filter are then wrong
+        with mock.patch.object(self.f, 'host_passes_context',
+                               return_value=True):
+            self.spec_obj.scheduler_hints = {}
+            self.assertEqual(hosts, self.f.filter_all(hosts, self.spec_obj))
+
+        self.assertEqual(1, mock_log.warning.call_count)
+        details = mock_log.warning.call_args[0][1]
+        self.assertEqual(['host2', 'host3'], details['unexpected'])
+        self.assertEqual([], details['missing'])
+        self.assertIn('blazar_filter_shadow_mismatches_total'
+                      '{request_class="plain"} 1\n', self.f.metrics.render())
+
+    # The reference shares no code with the filter
+    @mock.patch.object(blazar_filter, 'classify_request',
+                       side_effect=AssertionError)
+    @mock.patch.object(blazar_filter.pool_index, 'classify_aggregate',
+                       side_effect=AssertionError)
+    def test_reference_host_passes(self, mock_classify, mock_request):
+        hosts = self._hosts_for_filter_all()
+        settings = blazar_filter.load_settings()
+
+        self.assertEqual(
+            [True, False, False],
+            [blazar_filter.reference_host_passes(host, self.spec_obj,
+                                                 settings)
+             for host in hosts])
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        self.assertEqual(
+            [False, False, True],
+            [blazar_filter.reference_host_passes(host, self.spec_obj,
+                                                 settings)
+             for host in hosts])
+
+    def test_reference_host_passes_owner(self):
+        settings = blazar_filter.load_settings()
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        owned = self._hosts_in_pool({'blazar:owner': 'fakepj'}, count=1)
+        shared = self._hosts_in_pool({'blazar:owner': 'another_project_id',
+                                      'fakepj': 'blazar:tenant'}, count=1)
+        other = self._hosts_in_pool({'blazar:owner': 'another_project_id'},
+                                    count=1)
+
+        self.assertEqual(
+            [True, True, False],
+            [blazar_filter.reference_host_passes(hosts[0], self.spec_obj,
+                                                 settings)
+             for hosts in (owned, shared, other)])
+
+    def test_filter_all_uses_complete_index(self):
+        prefix = cfg.CONF['blazar:physical:host'].blazar_az_prefix
+        aggregates = [
+            objects.Aggregate(id=1, name='freepool', hosts=['host1'],
+                              metadata={}),
+            objects.Aggregate(id=2, name='r-fakeres', hosts=['host2'],
+                              metadata={'availability_zone': prefix})]
+        hosts = [fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+                 for i in (1, 2, 3)]
+        hosts[0].aggregates = aggregates[:1]
+        hosts[1].aggregates = aggregates[1:]
+        hosts[2].aggregates = []
+        self.f.pool_index.load_aggregates(aggregates)
+
+        with mock.patch.object(self.f, 'host_passes_context') as m:
+            self.assertEqual(hosts[2:],
+                             self.f.filter_all(hosts, self.spec_obj))
+        m.assert_not_called()
+
+    def _hosts_with_complete_index(self, count=10):
+        prefix = cfg.CONF['blazar:physical:host'].blazar_az_prefix
+        reserved = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host0', 'host1'],
+            metadata={'availability_zone': prefix,
+                      'blazar:owner': 'another_project_id',
+                      'fakepj': 'blazar:tenant'})
+        hosts = [fakes.FakeHostState('host%d' % i, 'node%d' % i, {})
+                 for i in range(count)]
+        for host in hosts:
+            host.aggregates = [reserved] if host.host in reserved.hosts else []
+        self.f.pool_index.load_aggregates([reserved])
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+        return hosts
+
+    @mock.patch.object(blazar_filter, 'LOG')
+    def test_filter_all_reservation_unknown_complete_index(self, mock_log):
+        hosts = self._hosts_with_complete_index()
+        self.spec_obj.scheduler_hints = {'reservation': ['r-unknown']}
+
+        with mock.patch.object(self.f, 'pool_signature') as m:
+            self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        m.assert_not_called()
+        mock_log.info.assert_called_once_with(
+            mock.ANY, {'tenant_id': 'fakepj', 'pool_ids': 'r-unknown',
+                       'reason': blazar_filter.REJECT_UNKNOWN_POOL})
+
+    def test_filter_all_reservation_members_filtered_out(self):
+        hosts = self._hosts_with_complete_index()
+
+        # The members of the pool were dropped by previous filters
+        with mock.patch.object(self.f, 'pool_signature') as m:
+            self.assertEqual([], self.f.filter_all(hosts[2:], self.spec_obj))
+        m.assert_not_called()
+
+    def test_filter_all_reservation_members_rejected(self):
+        hosts = self._hosts_with_complete_index()
+
+        with mock.patch.object(self.f, '_reject_reason',
+                               return_value=blazar_filter.REJECT_NOT_IN_POOL
+                               ) as m:
+            self.assertEqual([], self.f.filter_all(hosts, self.spec_obj))
+        # Only the members were checked, once per pool signature
+        self.assertEqual([mock.call(hosts[0], mock.ANY)], m.call_args_list)
@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import atexit
+import os
+from unittest import mock
+
+import fixtures
+
+from blazarnova.scheduler.filters import metrics
+from nova import test
+from oslo_utils import timeutils
+
+
+class FilterMetricsTestCase(test.NoDBTestCase):
+    """Tests for the metrics of BlazarFilter."""
+
+    def setUp(self):
+        super(FilterMetricsTestCase, self).setUp()
+        self.metrics = metrics.FilterMetrics()
+
+    def test_render(self):
+        self.metrics.record_request('plain', 0.002, 10, 3)
+        self.metrics.record_rejections({'in_blazar_pool': 7})
+        self.metrics.record_rejections({}, 'unauthorized')
+
+        text = self.metrics.render()
+
+        self.assertIn('# TYPE blazar_filter_requests_total counter\n'
+                      'blazar_filter_requests_total{request_class="plain"} 1'
+                      '\n', text)
+        self.assertIn('blazar_filter_host_rejections_total'
+                      '{reason="in_blazar_pool"} 7\n', text)
+        self.assertIn('blazar_filter_request_rejections_total'
+                      '{reason="unauthorized"} 1\n', text)
+        self.assertIn('# TYPE blazar_filter_duration_seconds histogram\n',
+                      text)
+        self.assertIn('blazar_filter_duration_seconds_bucket'
+                      '{request_class="plain",le="0.001"} 0\n', text)
+        self.assertIn('blazar_filter_duration_seconds_bucket'
+                      '{request_class="plain",le="0.0025"} 1\n', text)
+        self.assertIn('blazar_filter_duration_seconds_bucket'
+                      '{request_class="plain",le="+Inf"} 1\n', text)
+        self.assertIn('blazar_filter_hosts_out_bucket'
+                      '{request_class="plain",le="10"} 1\n', text)
+        self.assertIn('blazar_filter_hosts_in_count'
+                      '{request_class="plain"} 1\n', text)
+        self.assertIn('blazar_filter_hosts_in_sum'
+                      '{request_class="plain"} 10\n', text)
+
+    def test_render_gauge(self):
+        self.metrics.set_gauge('blazar_filter_index_warmup_seconds', 0.5)
+
+        self.assertIn('# TYPE blazar_filter_index_warmup_seconds gauge\n'
+                      'blazar_filter_index_warmup_seconds 0.5\n',
+                      self.metrics.render())
+
+    @mock.patch.object(atexit, 'register')
+    def test_export(self, mock_register):
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(tmpdir, 'blazar.prom')
+        self.metrics = metrics.FilterMetrics(path, 15)
+        callback = mock.Mock()
+        metrics.register_callback(callback)
+        self.addCleanup(metrics.unregister_callback, callback)
+        self.metrics.record_request('plain', 0.002, 10, 3)
+
+        with mock.patch.object(timeutils, 'now', return_value=100):
+            self.metrics.maybe_export()
+            self.metrics.record_request('plain', 0.002, 10, 3)
+            # Not exported again before the interval
+            self.metrics.maybe_export()
+
+        with open(os.path.join(tmpdir, 'blazar.%d.prom' % os.getpid())) as f:
+            text = f.read()
+        self.assertIn(
+            'blazar_filter_requests_total{pid="%d",request_class="plain"} '
+            '1\n' % os.getpid(), text)
+        self.assertFalse(os.path.exists(path))
+        # The callbacks get the metrics without the pid label
+        callback.assert_called_once_with(
+            text.replace('pid="%d",' % os.getpid(), ''))
+        # The file is removed when the process exits
+        mock_register.assert_called_once_with(
+            self.metrics._remove_textfile,
+            os.path.join(tmpdir, 'blazar.%d.prom' % os.getpid()))
+
+    @mock.patch.object(atexit, 'register')
+    def test_export_clean_up(self, mock_register):
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.metrics = metrics.FilterMetrics(
+            os.path.join(tmpdir, 'blazar.prom'), 15)
+        for name in ('blazar.42.prom', 'blazar.43.prom', 'blazar.x.prom'):
+            open(os.path.join(tmpdir, name), 'w').close()
+
+        def kill(pid, signal):
+            if pid == 42:
+                raise ProcessLookupError()
+
+        with mock.patch.object(os, 'kill', side_effect=kill) as mock_kill:
+            self.metrics.export()
+            # The files are only cleaned up once per process
+            self.metrics.export()
+
+        self.assertEqual([42, 43], sorted(
+            args[0] for args, kwargs in mock_kill.call_args_list))
+        own = 'blazar.%d.prom' % os.getpid()
+        self.assertEqual(sorted(['blazar.43.prom', 'blazar.x.prom', own]),
+                         sorted(os.listdir(tmpdir)))
+
+        remove, path = mock_register.call_args[0]
+        remove(path)
+        self.assertNotIn(own, os.listdir(tmpdir))
+
+    def test_export_per_process(self):
+        self.metrics = metrics.FilterMetrics('/textfiles/blazar.prom', 15)
+
+        with mock.patch.object(os, 'getpid', return_value=42):
+            self.assertEqual('/textfiles/blazar.42.prom',
+                             self.metrics.process_textfile())
+        with mock.patch.object(os, 'getpid', return_value=43):
+            self.assertEqual('/textfiles/blazar.43.prom',
+                             self.metrics.process_textfile())
+
+    def test_with_labels(self):
+        self.metrics.record_request('plain', 0.002, 10, 3)
+        self.metrics.set_gauge('blazar_filter_index_warmup_seconds', 0.5)
+
+        text = metrics._with_labels(self.metrics.render(), (('pid', 42),))
+
+        self.assertIn('blazar_filter_requests_total'
+                      '{pid="42",request_class="plain"} 1\n', text)
+        self.assertIn('blazar_filter_index_warmup_seconds{pid="42"} 0.5\n',
+                      text)
+        self.assertIn('blazar_filter_duration_seconds_bucket'
+                      '{pid="42",request_class="plain",le="+Inf"} 1\n', text)
+
+    def test_record_shadow(self):
+        self.metrics.record_shadow('plain', False, 0.5, 1.5)
+        self.metrics.record_shadow('plain', True, 0.25, 0.5)
+
+        text = self.metrics.render()
+
+        self.assertIn('blazar_filter_shadow_requests_total'
+                      '{request_class="plain"} 2\n', text)
+        self.assertIn('blazar_filter_shadow_mismatches_total'
+                      '{request_class="plain"} 1\n', text)
+        self.assertIn('blazar_filter_shadow_seconds_total'
+                      '{request_class="plain",implementation="reference"} '
+                      '2.0\n', text)
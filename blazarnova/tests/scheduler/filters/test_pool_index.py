@@ -0,0 +1,465 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sys
+import threading
+import time
+from unittest import mock
+
+from blazarnova.scheduler.filters import membership
+from blazarnova.scheduler.filters import pool_index
+from blazarnova.tests import fixtures as blazar_fixtures
+from nova import objects
+from nova.scheduler import host_manager
+from nova import test
+
+
+class PoolIndexTestCase(test.NoDBTestCase):
+    """Tests for the Blazar classification of aggregates."""
+
+    def setUp(self):
+        super(PoolIndexTestCase, self).setUp()
+        self.useFixture(blazar_fixtures.NovaHooks())
+        self.index = pool_index.PoolIndex()
+        self.index.set_settings('blazar_', 'freepool', 'preemptibles',
+                                'blazar:owner')
+
+    def test_classify(self):
+        reserved = objects.Aggregate(
+            id=1, name='r-fakeres',
+            metadata={'availability_zone': 'blazar_XX'})
+        legacy = objects.Aggregate(
+            id=2, name='r-legacy', metadata={'availability_zone': 'blazar:'})
+        freepool = objects.Aggregate(id=3, name='freepool', metadata={})
+        preemptibles = objects.Aggregate(id=4, name='preemptibles',
+                                         metadata={})
+        other = objects.Aggregate(id=5, name='other',
+                                  metadata={'availability_zone': 'nova'})
+
+        self.assertEqual(
+            pool_index.PoolInfo('r-fakeres', True, False, False,
+                                frozenset()),
+            self.index.classify(reserved))
+        self.assertTrue(self.index.classify(legacy).is_blazar_pool)
+        self.assertEqual(
+            pool_index.PoolInfo('freepool', False, True, False, frozenset()),
+            self.index.classify(freepool))
+        self.assertEqual(
+            pool_index.PoolInfo('preemptibles', False, False, True,
+                                frozenset()),
+            self.index.classify(preemptibles))
+        self.assertEqual(
+            pool_index.PoolInfo('other', False, False, False, frozenset()),
+            self.index.classify(other))
+
+    @mock.patch.object(pool_index, 'classify_aggregate',
+                       wraps=pool_index.classify_aggregate)
+    def test_classify_cached(self, mock_classify):
+        agg = objects.Aggregate(id=1, name='r-fakeres',
+                                metadata={'availability_zone': 'blazar_XX'})
+        same = objects.Aggregate(id=1, name='r-fakeres',
+                                 metadata={'availability_zone': 'blazar_XX'})
+
+        self.index.classify(agg)
+        self.index.classify(agg)
+        self.index.classify(same)
+
+        self.assertEqual(1, mock_classify.call_count)
+
+    def test_classify_invalidated_on_change(self):
+        agg = objects.Aggregate(id=1, name='r-fakeres',
+                                metadata={'availability_zone': 'blazar_XX'})
+        updated = objects.Aggregate(id=1, name='r-fakeres',
+                                    metadata={'availability_zone': 'nova'})
+
+        self.assertTrue(self.index.classify(agg).is_blazar_pool)
+        self.assertFalse(self.index.classify(updated).is_blazar_pool)
+
+    def test_classify_invalidated_on_settings_change(self):
+        agg = objects.Aggregate(id=1, name='preemptibles', metadata={})
+
+        self.assertTrue(self.index.classify(agg).is_preemptible)
+        self.index.set_settings('blazar_', 'freepool', 'freepool',
+                                'blazar:owner')
+        self.assertFalse(self.index.classify(agg).is_preemptible)
+
+    def test_hosts_in_pools(self):
+        reserved = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1', 'host2'],
+            metadata={'availability_zone': 'blazar_XX'})
+        freepool = objects.Aggregate(id=2, name='freepool', hosts=['host3'],
+                                     metadata={})
+        other = objects.Aggregate(id=3, name='other', hosts=['host4'],
+                                  metadata={})
+        for agg in (reserved, freepool, other):
+            self.index.classify(agg)
+
+        self.assertEqual({'host1', 'host2'},
+                         self.index.hosts_in_pools(['r-fakeres']))
+        self.assertEqual({'host1', 'host2', 'host3'},
+                         self.index.hosts_in_pools(['r-fakeres', 'freepool']))
+        self.assertIsNone(self.index.hosts_in_pools(['other']))
+        self.assertIsNone(self.index.hosts_in_pools(['r-unknown']))
+
+    def test_hosts_in_pools_updated(self):
+        agg = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1'],
+            metadata={'availability_zone': 'blazar_XX'})
+        updated = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1', 'host2'],
+            metadata={'availability_zone': 'blazar_XX'})
+
+        self.index.classify(agg)
+        generation = self.index.generation
+        self.index.classify(updated)
+
+        self.assertEqual({'host1', 'host2'},
+                         self.index.hosts_in_pools(['r-fakeres']))
+        self.assertGreater(self.index.generation, generation)
+
+        self.index.forget(1)
+        self.assertIsNone(self.index.hosts_in_pools(['r-fakeres']))
+
+    def test_authorized_pools(self):
+        owned = objects.Aggregate(
+            id=1, name='r-owned',
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project1'})
+        shared = objects.Aggregate(
+            id=2, name='r-shared',
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project2',
+                      'project1': 'blazar:tenant'})
+        other = objects.Aggregate(
+            id=3, name='other', metadata={'project1': 'blazar:tenant'})
+        for agg in (owned, shared, other):
+            self.index.classify(agg)
+
+        self.assertEqual(frozenset(['r-owned', 'r-shared']),
+                         self.index.authorized_pools('project1'))
+        self.assertEqual(frozenset(['r-shared']),
+                         self.index.authorized_pools('project2'))
+        self.assertEqual(frozenset(), self.index.authorized_pools('project3'))
+        # Only the project IDs are indexed, not the other metadata keys
+        self.assertEqual(['project1', 'project2'],
+                         sorted(self.index.snapshot.pools_by_project))
+
+    def test_authorized_pools_updated(self):
+        agg = objects.Aggregate(
+            id=1, name='r-fakeres',
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project1'})
+        updated = objects.Aggregate(
+            id=1, name='r-fakeres',
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project1',
+                      'project2': 'blazar:tenant'})
+
+        self.index.classify(agg)
+        self.assertEqual(frozenset(), self.index.authorized_pools('project2'))
+        self.index.classify(updated)
+        self.assertEqual(frozenset(['r-fakeres']),
+                         self.index.authorized_pools('project2'))
+
+        self.index.forget(1)
+        self.assertEqual(frozenset(), self.index.authorized_pools('project1'))
+        self.assertEqual(frozenset(), self.index.authorized_pools('project2'))
+
+    def test_update_aggregates(self):
+        agg = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1'],
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project1'})
+        moved = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1', 'host2'],
+            metadata={'availability_zone': 'blazar_XX',
+                      'blazar:owner': 'project1'})
+        self.index.classify(agg)
+        generation = self.index.generation
+
+        self.index.update_aggregates([moved])
+
+        self.assertEqual({'host1', 'host2'},
+                         self.index.hosts_in_pools(['r-fakeres']))
+        self.assertGreater(self.index.generation, generation)
+
+        self.index.delete_aggregate(moved)
+        self.assertIsNone(self.index.hosts_in_pools(['r-fakeres']))
+        self.assertEqual(frozenset(), self.index.authorized_pools('project1'))
+
+    def test_update_aggregates_without_settings(self):
+        index = pool_index.PoolIndex()
+        agg = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1'],
+            metadata={'availability_zone': 'blazar_XX'})
+
+        index.update_aggregates([agg])
+
+        self.assertIsNone(index.hosts_in_pools(['r-fakeres']))
+
+    # NOTE: Plain mocks, as the test base would otherwise autospec the
+    # patched methods.
+    @mock.patch.object(host_manager.HostManager, '_init_aggregates',
+                       new_callable=mock.Mock)
+    @mock.patch.object(host_manager.HostManager, 'delete_aggregate',
+                       new_callable=mock.Mock)
+    @mock.patch.object(host_manager.HostManager, 'update_aggregates',
+                       new_callable=mock.Mock)
+    def test_watch_host_manager(self, mock_update, mock_delete, mock_init):
+        pool_index.watch_host_manager(self.index)
+        # Watching with another index does not wrap the methods again
+        other_index = pool_index.PoolIndex()
+        wrapped = host_manager.HostManager.update_aggregates
+        pool_index.watch_host_manager(other_index)
+        self.assertIs(wrapped, host_manager.HostManager.update_aggregates)
+        manager = mock.Mock(spec=host_manager.HostManager)
+        agg = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1'],
+            metadata={'availability_zone': 'blazar_XX'})
+        manager.aggs_by_id = {}
+
+        host_manager.HostManager._init_aggregates(manager)
+        mock_init.assert_called_once_with(manager)
+        self.assertTrue(self.index.complete)
+        self.assertIsNotNone(self.index.warmup_duration)
+
+        host_manager.HostManager.update_aggregates(manager, [agg])
+        mock_update.assert_called_once_with(manager, [agg])
+        self.assertEqual({'host1'}, self.index.hosts_in_pools(['r-fakeres']))
+
+        host_manager.HostManager.delete_aggregate(manager, agg)
+        mock_delete.assert_called_once_with(manager, agg)
+        self.assertIsNone(self.index.hosts_in_pools(['r-fakeres']))
+
+        # NOTE: Unwatched before the mocks are removed, which would
+        # otherwise be restored as the original methods.
+        pool_index.unwatch_host_manager()
+        self.assertIs(mock_init, host_manager.HostManager._init_aggregates)
+        self.assertIs(mock_update,
+                      host_manager.HostManager.update_aggregates)
+        self.assertIs(mock_delete, host_manager.HostManager.delete_aggregate)
+        host_manager.HostManager.update_aggregates(manager, [agg])
+        self.assertIsNone(self.index.hosts_in_pools(['r-fakeres']))
+
+    @mock.patch.object(pool_index, 'LOG')
+    def test_warm_up(self, mock_log):
+        self.index.warm_up([
+            objects.Aggregate(id=1, name='freepool', hosts=['host1'],
+                              metadata={}),
+            objects.Aggregate(id=2, name='other', hosts=['host2'],
+                              metadata={})])
+
+        self.assertTrue(self.index.complete)
+        self.assertEqual({'host1'}, self.index.hosts_in_pools(['freepool']))
+        self.assertIsNotNone(self.index.warmup_duration)
+        mock_log.info.assert_called_once_with(
+            mock.ANY, {'aggregates': 2, 'pools': 1,
+                       'duration': self.index.warmup_duration})
+
+    @mock.patch.object(pool_index, 'classify_aggregate',
+                       side_effect=ValueError)
+    def test_warm_up_failed(self, mock_classify):
+        self.index.warm_up([
+            objects.Aggregate(id=1, name='freepool', hosts=['host1'],
+                              metadata={})])
+
+        # The index is built lazily instead
+        self.assertFalse(self.index.complete)
+        self.assertIsNone(self.index.warmup_duration)
+        self.assertIsNone(self.index.hosts_in_pools(['freepool']))
+        mock_classify.side_effect = None
+        mock_classify.return_value = pool_index.PoolInfo(
+            'freepool', False, True, False, frozenset())
+        self.index.classify(objects.Aggregate(
+            id=1, name='freepool', hosts=['host1'], metadata={}))
+        self.assertEqual({'host1'}, self.index.hosts_in_pools(['freepool']))
+
+    def test_select_hosts(self):
+        aggregates = [
+            objects.Aggregate(id=1, name='r-fakeres', hosts=['host1'],
+                              metadata={'availability_zone': 'blazar_XX'}),
+            objects.Aggregate(id=2, name='freepool', hosts=['host2'],
+                              metadata={}),
+            objects.Aggregate(id=3, name='preemptibles',
+                              hosts=['host2', 'host3'], metadata={}),
+            objects.Aggregate(id=4, name='other', hosts=['host4'],
+                              metadata={}),
+        ]
+        host_states = [mock.Mock(host='host%d' % i) for i in range(1, 6)]
+
+        self.assertIsNone(self.index.select_hosts(
+            host_states, membership.UNPOOLED))
+
+        self.index.load_aggregates(aggregates)
+
+        self.assertEqual(
+            host_states[3:],
+            self.index.select_hosts(host_states, membership.UNPOOLED))
+        self.assertEqual(
+            host_states[2:3],
+            self.index.select_hosts(host_states,
+                                    membership.PREEMPTIBLE_ONLY))
+
+        # host3 then moves to the reservation pool
+        generation = self.index.generation
+        self.index.update_aggregates([
+            objects.Aggregate(id=1, name='r-fakeres',
+                              hosts=['host1', 'host3'],
+                              metadata={'availability_zone': 'blazar_XX'}),
+            objects.Aggregate(id=3, name='preemptibles', hosts=['host2'],
+                              metadata={})])
+
+        self.assertGreater(self.index.generation, generation)
+        self.assertEqual(
+            [], self.index.select_hosts(host_states,
+                                        membership.PREEMPTIBLE_ONLY))
+        self.assertEqual({'host1', 'host3'},
+                         self.index.hosts_in_pools(['r-fakeres']))
+
+    def test_hosts_of_kind(self):
+        self.index.load_aggregates([
+            objects.Aggregate(id=1, name='freepool', hosts=['host1'],
+                              metadata={}),
+            objects.Aggregate(id=2, name='preemptibles',
+                              hosts=['host2', 'host3'], metadata={})])
+        matrix = self.index.snapshot.membership
+
+        self.assertEqual({'host2', 'host3'},
+                         matrix.hosts_of_kind(membership.PREEMPTIBLE_ONLY))
+        self.assertEqual({'host1'}, matrix.hosts_of_kind(membership.POOLED))
+
+        self.index.update_aggregates([
+            objects.Aggregate(id=1, name='freepool', hosts=['host1', 'host3'],
+                              metadata={})])
+
+        self.assertEqual({'host2', 'host3'},
+                         matrix.hosts_of_kind(membership.PREEMPTIBLE_ONLY))
+        matrix = self.index.snapshot.membership
+        self.assertEqual({'host2'},
+                         matrix.hosts_of_kind(membership.PREEMPTIBLE_ONLY))
+        self.assertEqual({'host1', 'host3'},
+                         matrix.hosts_of_kind(membership.POOLED))
+        host_states = [mock.Mock(host='host%d' % i) for i in range(1, 5)]
+        self.assertEqual(host_states[3:], self.index.select_hosts(
+            host_states, membership.UNPOOLED))
+
+    def test_load_aggregates_reloaded_on_settings_change(self):
+        self.index.load_aggregates([
+            objects.Aggregate(id=1, name='preemptibles', hosts=['host1'],
+                              metadata={})])
+        host_states = [mock.Mock(host='host1')]
+
+        self.index.set_settings('blazar_', 'freepool', 'freepool',
+                                'blazar:owner')
+
+        self.assertTrue(self.index.complete)
+        self.assertEqual(host_states, self.index.select_hosts(
+            host_states, membership.UNPOOLED))
+
+    def test_incomplete_without_pool_hosts(self):
+        self.index.load_aggregates([
+            objects.Aggregate(id=1, name='freepool', metadata={})])
+
+        self.assertFalse(self.index.complete)
+
+    def test_snapshot_unchanged_by_updates(self):
+        self.index.load_aggregates([
+            objects.Aggregate(id=1, name='freepool', hosts=['host1'],
+                              metadata={'fakeproject': 'true'})])
+        snapshot = self.index.snapshot
+
+        self.index.update_aggregates([
+            objects.Aggregate(id=1, name='freepool', hosts=['host2'],
+                              metadata={})])
+
+        self.assertEqual({'host1'}, snapshot.hosts_in_pools(['freepool']))
+        self.assertEqual({'freepool'},
+                         snapshot.authorized_pools('fakeproject'))
+        self.assertEqual({'host2'},
+                         self.index.hosts_in_pools(['freepool']))
+        self.assertEqual(frozenset(),
+                         self.index.authorized_pools('fakeproject'))
+        self.assertGreater(self.index.snapshot.generation,
+                           snapshot.generation)
+
+    def test_unchanged_pool_not_copied(self):
+        matrix = membership.MembershipMatrix()
+        matrix.set_pool('freepool', ['host1', 'host2'])
+        view = matrix.view()
+
+        self.assertFalse(matrix.set_pool('freepool', ['host2', 'host1']))
+        self.assertFalse(matrix.remove_pool('unknown'))
+        self.assertIs(view.kinds, matrix.kinds)
+        self.assertIs(view._pools, matrix._pools)
+
+        self.assertTrue(matrix.set_pool('freepool', ['host1', 'host3']))
+        self.assertIsNot(view.kinds, matrix.kinds)
+        self.assertEqual({'host1', 'host2'}, view.hosts_in(['freepool']))
+        self.assertEqual({'host1', 'host3'}, matrix.hosts_in(['freepool']))
+
+    def test_concurrent_reads_and_updates(self):
+        host_states = [mock.Mock(host='host%d' % i) for i in range(60)]
+
+        def aggregates(flip):
+            # The freepool and the preemptible aggregate swap their hosts
+            freepool = ['host%d' % i for i in range(30)]
+            preemptibles = ['host%d' % i for i in range(30, 45)]
+            if flip:
+                freepool = ['host%d' % i for i in range(30, 60)]
+                preemptibles = ['host%d' % i for i in range(15)]
+            return [
+                objects.Aggregate(id=1, name='freepool', hosts=freepool,
+                                  metadata={}),
+                objects.Aggregate(id=2, name='preemptibles',
+                                  hosts=preemptibles, metadata={})]
+
+        def decisions(snapshot):
+            return (
+                [h.host for h in snapshot.select_hosts(
+                    host_states, membership.UNPOOLED)],
+                [h.host for h in snapshot.select_hosts(
+                    host_states, membership.PREEMPTIBLE_ONLY)],
+                snapshot.hosts_in_pools(['freepool']))
+
+        expected = []
+        for flip in (False, True):
+            self.index.load_aggregates(aggregates(flip))
+            expected.append(decisions(self.index.snapshot))
+
+        unexpected = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                result = decisions(self.index.snapshot)
+                if result not in expected:
+                    unexpected.append(result)
+                # NOTE: Yield, as the threads are green threads once
+                # eventlet patched the test run.
+                time.sleep(0)
+
+        # Switch threads as often as possible to interleave them
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        readers = [threading.Thread(target=read) for i in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i in range(1000):
+                self.index.update_aggregates(aggregates(i % 2))
+                time.sleep(0)
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertEqual([], unexpected)
@@ -0,0 +1,179 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+import fixtures
+from keystoneauth1 import adapter
+from keystoneauth1 import exceptions as ks_exc
+from keystoneauth1 import session
+from oslo_utils import timeutils
+from wsgi_intercept import interceptor as interceptor_mod
+
+from blazarnova.scheduler.filters import reservation_cache
+from nova import test
+
+
+def _lease(reservation_id, start, end, status='active',
+           resource_type='physical:host'):
+    now = datetime.datetime(2030, 1, 1, 12)
+    return {
+        'id': 'lease-' + reservation_id,
+        'start_date': (now + start).strftime('%Y-%m-%dT%H:%M:%S.000000'),
+        'end_date': (now + end).strftime('%Y-%m-%dT%H:%M:%S.000000'),
+        'reservations': [{'id': reservation_id, 'status': status,
+                          'resource_type': resource_type}],
+    }
+
+
+class _BlazarAPI(object):
+    """A WSGI stub of the lease listing of the Blazar API."""
+
+    def __init__(self, leases):
+        self.leases = leases
+        self.requests = []
+        self.status = 200
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        self.requests.append(path)
+        status = self.status if path == '/v1/leases' else 404
+        if status != 200:
+            start_response('%d Error' % status, [])
+            return [b'']
+        body = json.dumps({'leases': self.leases}).encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class ReservationCacheTestCase(test.NoDBTestCase):
+    """Tests of the reservation cache against a Blazar API stub.
+
+    The stub is served in process through wsgi-intercept, so that it needs
+    neither a socket nor a thread of its own.
+    """
+
+    HOST = 'blazar.example.com'
+    PORT = 1234
+
+    def setUp(self):
+        super(ReservationCacheTestCase, self).setUp()
+        hour = datetime.timedelta(hours=1)
+        self.api = _BlazarAPI([
+            _lease('r-active', -hour, hour),
+            _lease('r-ended', -2 * hour, -hour),
+            _lease('r-future', hour, 2 * hour, status='pending'),
+            _lease('r-deleted', -hour, hour, status='deleted'),
+            # Started, but Blazar did not mark it active yet
+            _lease('r-starting', -hour, hour, status='pending'),
+            _lease('r-instance', -2 * hour, -hour,
+                   resource_type='virtual:instance'),
+        ])
+        endpoint = 'http://%s:%d/v1' % (self.HOST, self.PORT)
+        client = reservation_cache.BlazarClient(adapter.Adapter(
+            session.Session(), endpoint_override=endpoint))
+        self.cache = reservation_cache.ReservationCache(client, 0.01, 60)
+        self.useFixture(fixtures.MockPatchObject(
+            timeutils, 'utcnow',
+            return_value=datetime.datetime(2030, 1, 1, 12)))
+
+    def _intercept(self):
+        interceptor = interceptor_mod.RequestsInterceptor(
+            lambda: self.api, host=self.HOST, port=self.PORT)
+        interceptor.__enter__()
+        self.addCleanup(interceptor.__exit__, None, None, None)
+
+    def test_refresh(self):
+        self._intercept()
+        self.cache.refresh()
+
+        self.assertEqual(['/v1/leases'], self.api.requests)
+        self.assertTrue(self.cache.is_fresh())
+        self.assertEqual(
+            reservation_cache.ReservationState(
+                status='active',
+                start=datetime.datetime(2030, 1, 1, 11),
+                end=datetime.datetime(2030, 1, 1, 13)),
+            self.cache.get('r-active'))
+        self.assertIsNone(self.cache.get('r-instance'))
+
+    def test_is_inactive(self):
+        self._intercept()
+        self.cache.refresh()
+
+        for reservation_ids in (['r-ended'], ['r-future'], ['r-deleted'],
+                                ['r-ended', 'r-future']):
+            self.assertTrue(self.cache.is_inactive(reservation_ids),
+                            reservation_ids)
+        for reservation_ids in (['r-active'], ['r-starting'], ['r-unknown'],
+                                ['r-ended', 'r-active'],
+                                ['r-ended', 'r-unknown'], []):
+            self.assertFalse(self.cache.is_inactive(reservation_ids),
+                             reservation_ids)
+
+    def test_is_inactive_not_fresh(self):
+        self._intercept()
+        self.assertFalse(self.cache.is_inactive(['r-ended']))
+
+        self.cache.refresh()
+        with mock.patch.object(timeutils, 'now',
+                               return_value=self.cache.refreshed_at + 61):
+            self.assertFalse(self.cache.is_fresh())
+            self.assertFalse(self.cache.is_inactive(['r-ended']))
+
+    def test_refresh_failure(self):
+        self._intercept()
+        self.cache.refresh()
+        self.api.status = 500
+
+        self.assertRaises(ks_exc.InternalServerError, self.cache.refresh)
+        # The previous states are kept until they get too old
+        self.assertTrue(self.cache.is_inactive(['r-ended']))
+
+    def test_start_stop(self):
+        self._intercept()
+        self.api.status = 503
+        with mock.patch.object(reservation_cache, 'LOG') as mock_log:
+            self.cache.start()
+            self.addCleanup(self.cache.stop)
+            while not mock_log.exception.called:
+                time.sleep(0.01)
+        self.assertIsNone(self.cache.refreshed_at)
+
+        self.api.status = 200
+        while self.cache.refreshed_at is None:
+            time.sleep(0.01)
+        self.cache.stop()
+        requests = len(self.api.requests)
+
+        self.assertTrue(self.cache.is_inactive(['r-ended']))
+        self.assertGreater(requests, 1)
+        time.sleep(0.05)
+        self.assertEqual(requests, len(self.api.requests))
+
+    @mock.patch.object(threading, 'Thread')
+    def test_start_once_per_process(self, mock_thread):
+        self.cache.start()
+        self.cache.start()
+        self.assertEqual(1, mock_thread.return_value.start.call_count)
+
+        # The thread of the parent does not run in a forked worker
+        with mock.patch.object(os, 'getpid', return_value=os.getpid() + 1):
+            self.cache.start()
+            self.cache.start()
+        self.assertEqual(2, mock_thread.return_value.start.call_count)
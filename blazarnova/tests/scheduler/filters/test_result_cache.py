@@ -0,0 +1,64 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from blazarnova.scheduler.filters import result_cache
+from nova import test
+from oslo_utils import timeutils
+
+
+class ResultCacheTestCase(test.NoDBTestCase):
+    """Tests for the cache of filter decisions."""
+
+    def setUp(self):
+        super(ResultCacheTestCase, self).setUp()
+        self.cache = result_cache.ResultCache(2, 10)
+        self.now = 100
+        patcher = mock.patch.object(timeutils, 'now',
+                                    side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('key', 1, ['host1']))
+        self.cache.put('key', 1, {'host1': True, 'host2': False})
+
+        self.assertEqual({'host1': True, 'host2': False},
+                         self.cache.get('key', 1, ['host1', 'host2']))
+        # Decisions for host3 are unknown
+        self.assertIsNone(self.cache.get('key', 1, ['host1', 'host3']))
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 2,
+                          'invalidations': 0}, self.cache.stats())
+
+    def test_expiry(self):
+        self.cache.put('key', 1, {'host1': True})
+        self.now += 11
+
+        self.assertIsNone(self.cache.get('key', 1, ['host1']))
+        self.assertEqual(0, self.cache.stats()['size'])
+
+    def test_lru(self):
+        self.cache.put('key1', 1, {'host1': True})
+        self.cache.put('key2', 1, {'host1': True})
+        self.cache.get('key1', 1, ['host1'])
+        self.cache.put('key3', 1, {'host1': True})
+
+        self.assertIsNotNone(self.cache.get('key1', 1, ['host1']))
+        self.assertIsNone(self.cache.get('key2', 1, ['host1']))
+        self.assertIsNotNone(self.cache.get('key3', 1, ['host1']))
+
+    def test_invalidated_on_generation_change(self):
+        self.cache.put('key', 1, {'host1': True})
+
+        self.assertIsNone(self.cache.get('key', 2, ['host1']))
+        self.assertEqual(1, self.cache.stats()['invalidations'])
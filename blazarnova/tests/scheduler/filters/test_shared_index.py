@@ -0,0 +1,226 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+from unittest import mock
+
+import fixtures
+
+from blazarnova.scheduler.filters import membership
+from blazarnova.scheduler.filters import pool_index
+from blazarnova.scheduler.filters import shared_index
+from blazarnova.tests import fixtures as blazar_fixtures
+from nova import objects
+from nova import test
+
+
+class SharedIndexTestCase(test.NoDBTestCase):
+    """Tests for the pool index shared between workers."""
+
+    def setUp(self):
+        super(SharedIndexTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'pool-index')
+        self.publisher = self._index()
+        self.reader = self._index()
+        self.aggregates = [
+            objects.Aggregate(id=1, name='r-fakeres', hosts=['host1'],
+                              metadata={'availability_zone': 'blazar_XX',
+                                        'blazar:owner': 'fakeproject'}),
+            objects.Aggregate(id=2, name='freepool', hosts=['host2'],
+                              metadata={}),
+            objects.Aggregate(id=3, name='preemptibles',
+                              hosts=['host2', 'host3'], metadata={}),
+        ]
+        self.host_states = [mock.Mock(host='host%d' % i)
+                            for i in range(1, 5)]
+
+    def _index(self):
+        index = pool_index.PoolIndex()
+        index.set_settings('blazar_', 'freepool', 'preemptibles',
+                           'blazar:owner')
+        index.shared = shared_index.SharedIndex(self.path)
+        return index
+
+    def _publish(self):
+        self.publisher.load_aggregates(self.aggregates)
+        self.publisher.sync_shared()
+
+    def test_one_publisher(self):
+        # The lock is only taken once the index is synchronized
+        self.assertFalse(self.publisher.shared.publisher)
+        self.assertFalse(os.path.exists(self.path + '.lock'))
+
+        self.publisher.sync_shared()
+        self.reader.sync_shared()
+
+        self.assertTrue(self.publisher.shared.publisher)
+        self.assertFalse(self.reader.shared.publisher)
+
+    @mock.patch.object(pool_index, 'LOG')
+    def test_lock_not_opened(self, mock_log):
+        self.publisher.shared = shared_index.SharedIndex(
+            os.path.join(self.path, 'missing', 'pool-index'))
+
+        self.assertFalse(self.publisher.sync_shared())
+
+        # The worker keeps using its own index
+        self.assertIsNone(self.publisher.shared)
+        self.assertEqual(1, mock_log.exception.call_count)
+        self.publisher.load_aggregates(self.aggregates)
+        self.assertEqual({'host1'},
+                         self.publisher.hosts_in_pools(['r-fakeres']))
+
+    def test_forked_publisher(self):
+        self._publish()
+        parent_lock_file = self.publisher.shared._lock_file
+
+        with mock.patch.object(os, 'getpid', return_value=os.getpid() + 1):
+            self.publisher.sync_shared()
+
+        # The worker took a lock of its own and published its index again
+        self.assertTrue(self.publisher.shared.publisher)
+        self.assertIsNot(parent_lock_file, self.publisher.shared._lock_file)
+        self.assertTrue(parent_lock_file.closed)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(self.reader.sync_shared())
+
+    def test_forked_from_publisher(self):
+        self._publish()
+        # The reader stands for a worker forked from the publisher, which
+        # shares its open lock file
+        self.reader.shared._lock_file = self.publisher.shared._lock_file
+        self.reader.shared.publisher = True
+        self.reader.shared._pid = -1
+
+        self.reader.sync_shared()
+
+        # The lock of the parent was released for the worker to take it
+        self.assertTrue(self.reader.shared.publisher)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_adopt(self):
+        self._publish()
+
+        with mock.patch.object(self.reader, 'classify') as mock_classify:
+            self.reader.load_aggregates(self.aggregates)
+        mock_classify.assert_not_called()
+
+        self.assertTrue(self.reader.complete)
+        self.assertEqual({'host1'},
+                         self.reader.hosts_in_pools(['r-fakeres']))
+        self.assertEqual({'r-fakeres'},
+                         self.reader.authorized_pools('fakeproject'))
+        self.assertEqual(
+            self.host_states[3:],
+            self.reader.select_hosts(self.host_states, membership.UNPOOLED))
+        self.assertEqual(
+            self.host_states[2:3],
+            self.reader.select_hosts(self.host_states,
+                                     membership.PREEMPTIBLE_ONLY))
+
+    def test_adopt_once_per_publication(self):
+        self._publish()
+        self.assertTrue(self.reader.sync_shared())
+        generation = self.reader.generation
+
+        self.assertFalse(self.reader.sync_shared())
+        self.assertEqual(generation, self.reader.generation)
+
+        self.publisher.delete_aggregate(self.aggregates[0])
+        self.publisher.sync_shared()
+
+        self.assertTrue(self.reader.sync_shared())
+        self.assertGreater(self.reader.generation, generation)
+        self.assertIsNone(self.reader.hosts_in_pools(['r-fakeres']))
+
+    def test_update_adopted(self):
+        self._publish()
+        self.reader.sync_shared()
+
+        self.reader.update_aggregates([
+            objects.Aggregate(id=1, name='r-fakeres',
+                              hosts=['host1', 'host3'],
+                              metadata={'availability_zone': 'blazar_XX'})])
+
+        self.assertEqual({'host1', 'host3'},
+                         self.reader.hosts_in_pools(['r-fakeres']))
+        self.assertEqual([], self.reader.select_hosts(
+            self.host_states, membership.PREEMPTIBLE_ONLY))
+        # The change was made in a copy, not in the published arrays
+        self.assertEqual({'host1'},
+                         self.publisher.hosts_in_pools(['r-fakeres']))
+
+    def test_delete_adopted(self):
+        self._publish()
+        self.reader.sync_shared()
+
+        self.reader.delete_aggregate(self.aggregates[0])
+
+        self.assertIsNone(self.reader.hosts_in_pools(['r-fakeres']))
+        self.assertEqual(frozenset(),
+                         self.reader.authorized_pools('fakeproject'))
+
+    def test_changes_left_to_publisher(self):
+        self.useFixture(blazar_fixtures.NovaHooks())
+        self._publish()
+        self.reader.sync_shared()
+        pool_index._WATCHING_INDEXES.update([self.publisher, self.reader])
+        aggregate = objects.Aggregate(
+            id=1, name='r-fakeres', hosts=['host1', 'host3'],
+            metadata={'availability_zone': 'blazar_XX'})
+
+        with mock.patch.object(self.reader,
+                               'update_aggregates') as mock_update:
+            pool_index._notify_indexes('update_aggregates', [aggregate])
+        mock_update.assert_not_called()
+
+        # The reader adopts the change the publisher made
+        self.reader.sync_shared()
+        self.assertEqual({'host1', 'host3'},
+                         self.reader.hosts_in_pools(['r-fakeres']))
+
+    def test_changes_without_publication(self):
+        self.useFixture(blazar_fixtures.NovaHooks())
+        # The publisher did not publish anything yet
+        self.assertTrue(self.publisher.shared.try_publish())
+        pool_index._WATCHING_INDEXES.add(self.reader)
+
+        pool_index._notify_indexes('update_aggregates', self.aggregates)
+
+        self.assertFalse(self.reader.shared.adopted)
+        self.assertEqual({'host1'},
+                         self.reader.hosts_in_pools(['r-fakeres']))
+
+    def test_other_settings(self):
+        self._publish()
+        self.reader.set_settings('blazar_', 'freepool', 'freepool',
+                                 'blazar:owner')
+
+        self.assertFalse(self.reader.sync_shared())
+        self.assertFalse(self.reader.complete)
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * shared_index.HEADER.size)
+
+        self.assertFalse(self.reader.sync_shared())
+        self.assertFalse(self.reader.complete)
+
+    def test_previous_publication_dropped(self):
+        self._publish()
+        self.publisher.shared._lock_file.close()
+
+        self.reader.shared._next_lock_attempt = 0
+
+        self.assertTrue(self.reader.shared.try_publish())
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,68 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from blazarnova.scheduler.filters import tracing
+from nova import test
+
+
+class TracingTestCase(test.NoDBTestCase):
+    """Tests for the trace points of BlazarFilter."""
+
+    def setUp(self):
+        super(TracingTestCase, self).setUp()
+        self.collector = tracing.Collector()
+
+    @mock.patch.object(tracing, 'profiler', None)
+    def test_span_disabled(self):
+        with tracing.span('test', size=1) as info:
+            info['result'] = 2
+
+        self.assertFalse(tracing.enabled())
+        self.assertEqual([], self.collector.spans)
+
+    @mock.patch.object(tracing, 'profiler', None)
+    def test_span_collected(self):
+        tracing.add_collector(self.collector)
+        self.addCleanup(tracing.remove_collector, self.collector)
+
+        with tracing.span('test', size=1) as info:
+            info['result'] = 2
+
+        span = self.collector.find('test')[0]
+        self.assertEqual({'size': 1, 'result': 2}, span.info)
+        self.assertGreaterEqual(span.duration, 0)
+
+    @mock.patch.object(tracing, 'profiler')
+    def test_span_profiled(self, mock_profiler):
+        with tracing.span('test', size=1) as info:
+            info['result'] = 2
+
+        mock_profiler.start.assert_called_once_with('test',
+                                                    info={'size': 1})
+        mock_profiler.stop.assert_called_once_with(
+            info={'size': 1, 'result': 2})
+
+    @mock.patch.object(tracing, 'profiler', None)
+    def test_traced(self):
+        tracing.add_collector(self.collector)
+        self.addCleanup(tracing.remove_collector, self.collector)
+
+        @tracing.traced('test', lambda items: {'items': len(items)})
+        def fake_fn(items):
+            return items[1:]
+
+        self.assertEqual([2, 3], fake_fn([1, 2, 3]))
+
+        self.assertEqual({'items': 3, 'result': 2},
+                         self.collector.find('test')[0].info)
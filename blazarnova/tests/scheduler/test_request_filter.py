@@ -0,0 +1,208 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from blazarnova.scheduler import request_filter
+from nova import context as nova_context
+from nova import exception
+from nova import objects
+from nova.scheduler import request_filter as nova_request_filter
+from nova import test
+from oslo_utils.fixture import uuidsentinel as uuids
+
+
+class BlazarRequestFilterTestCase(test.NoDBTestCase):
+    """Tests for the Blazar request filters."""
+
+    def setUp(self):
+        super(BlazarRequestFilterTestCase, self).setUp()
+        self.context = nova_context.RequestContext(user_id=uuids.user,
+                                                   project_id=uuids.project)
+        self.flags(placement_reservation_prefilter=True,
+                   group='blazar:physical:host')
+        self.aggregates = objects.AggregateList(objects=[
+            objects.Aggregate(
+                uuid=uuids.reserved, name='r-fakeres', hosts=['host1'],
+                metadata={'availability_zone': 'blazar_'}),
+            objects.Aggregate(
+                uuid=uuids.freepool, name='freepool', hosts=['host2'],
+                metadata={}),
+            objects.Aggregate(
+                uuid=uuids.other, name='other', hosts=['host3'],
+                metadata={'availability_zone': 'nova'}),
+            objects.Aggregate(
+                uuid=uuids.preemptibles, name='preemptibles',
+                hosts=['host4'], metadata={})])
+        self.spec_obj = objects.RequestSpec(
+            project_id=uuids.project,
+            scheduler_hints={},
+            flavor=objects.Flavor(flavorid='flavor-id1', extra_specs={}))
+
+    def test_register(self):
+        with mock.patch.object(nova_request_filter, 'ALL_REQUEST_FILTERS',
+                               new=[mock.sentinel.nova_filter]):
+            request_filter.register()
+            request_filter.register()
+            self.assertEqual(
+                [mock.sentinel.nova_filter] +
+                request_filter.BLAZAR_REQUEST_FILTERS,
+                nova_request_filter.ALL_REQUEST_FILTERS)
+
+            request_filter.unregister()
+            self.assertEqual([mock.sentinel.nova_filter],
+                             nova_request_filter.ALL_REQUEST_FILTERS)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_reservation_aggregate(self, mock_get_all):
+        mock_get_all.return_value = self.aggregates
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        self.assertTrue(request_filter.require_reservation_aggregate(
+            self.context, self.spec_obj))
+
+        self.assertEqual([uuids.reserved],
+                         self.spec_obj.requested_destination.aggregates)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_reservation_aggregate_unknown(self, mock_get_all):
+        mock_get_all.return_value = self.aggregates
+        self.spec_obj.scheduler_hints = {'reservation': ['r-unknown']}
+
+        self.assertRaises(exception.RequestFilterFailed,
+                          request_filter.require_reservation_aggregate,
+                          self.context, self.spec_obj)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_reservation_aggregate_no_hint(self, mock_get_all):
+        self.assertFalse(request_filter.require_reservation_aggregate(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+        self.assertNotIn('requested_destination', self.spec_obj)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_reservation_aggregate_disabled(self, mock_get_all):
+        self.flags(placement_reservation_prefilter=False,
+                   group='blazar:physical:host')
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        self.assertFalse(request_filter.require_reservation_aggregate(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_exclude_blazar_pools(self, mock_get_all):
+        self.flags(placement_exclude_pools_prefilter=True,
+                   group='blazar:physical:host')
+        mock_get_all.return_value = self.aggregates
+
+        self.assertTrue(request_filter.exclude_blazar_pools(
+            self.context, self.spec_obj))
+
+        self.assertEqual(
+            set([uuids.reserved, uuids.freepool]),
+            self.spec_obj.requested_destination.forbidden_aggregates)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_exclude_blazar_pools_reservation(self, mock_get_all):
+        self.flags(placement_exclude_pools_prefilter=True,
+                   group='blazar:physical:host')
+        self.spec_obj.scheduler_hints = {'reservation': ['r-fakeres']}
+
+        self.assertFalse(request_filter.exclude_blazar_pools(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_exclude_blazar_pools_instance_reservation(self, mock_get_all):
+        self.flags(placement_exclude_pools_prefilter=True,
+                   group='blazar:physical:host')
+        self.spec_obj.flavor.extra_specs = {
+            'aggregate_instance_extra_specs:reservation': 'id1'}
+
+        self.assertFalse(request_filter.exclude_blazar_pools(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_exclude_blazar_pools_disabled(self, mock_get_all):
+        self.assertFalse(request_filter.exclude_blazar_pools(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+
+    def _preemptible_request(self):
+        self.flags(placement_preemptible_prefilter=True,
+                   allow_preemptibles=True,
+                   preemptible_aggregate='preemptibles',
+                   group='blazar:physical:host')
+        self.spec_obj.flavor.extra_specs = {'blazar:preemptible': 'true'}
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_preemptible_aggregate(self, mock_get_all):
+        self._preemptible_request()
+        mock_get_all.return_value = self.aggregates
+
+        self.assertTrue(request_filter.require_preemptible_aggregate(
+            self.context, self.spec_obj))
+
+        destination = self.spec_obj.requested_destination
+        self.assertEqual([uuids.preemptibles], destination.aggregates)
+        self.assertEqual(set([uuids.reserved, uuids.freepool]),
+                         destination.forbidden_aggregates)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_preemptible_aggregate_unknown(self, mock_get_all):
+        self._preemptible_request()
+        mock_get_all.return_value = objects.AggregateList(
+            objects=self.aggregates.objects[:3])
+
+        self.assertRaises(exception.RequestFilterFailed,
+                          request_filter.require_preemptible_aggregate,
+                          self.context, self.spec_obj)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_preemptible_aggregate_not_preemptible(self,
+                                                           mock_get_all):
+        self._preemptible_request()
+        self.spec_obj.flavor.extra_specs = {'blazar:preemptible': 'no'}
+
+        self.assertFalse(request_filter.require_preemptible_aggregate(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+        self.assertNotIn('requested_destination', self.spec_obj)
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_preemptible_aggregate_not_allowed(self, mock_get_all):
+        self._preemptible_request()
+        self.flags(allow_preemptibles=False, group='blazar:physical:host')
+
+        self.assertFalse(request_filter.require_preemptible_aggregate(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()
+
+    @mock.patch('nova.objects.AggregateList.get_all')
+    def test_require_preemptible_aggregate_disabled(self, mock_get_all):
+        self._preemptible_request()
+        self.flags(placement_preemptible_prefilter=False,
+                   group='blazar:physical:host')
+
+        self.assertFalse(request_filter.require_preemptible_aggregate(
+            self.context, self.spec_obj))
+
+        mock_get_all.assert_not_called()